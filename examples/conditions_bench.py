@@ -0,0 +1,128 @@
+from string_theory.condition import Condition, observation, enable_observation, disable_observation
+
+from timeit import repeat, timeit
+
+import sys
+
+
+leaves = [Condition(f'leaf {i}') for i in range(16)]
+conjunction = leaves[0] & leaves[1] & leaves[2] & leaves[3]
+mixed = (leaves[4] | ~leaves[5]) & (leaves[6] | leaves[7] | leaves[8])
+wide = leaves[0]
+for leaf in leaves[1:]:
+    wide = wide | leaf
+composites = [conjunction, mixed, wide]
+
+
+def sut():
+    '''A stand-in for a system under test that triggers a few conditions'''
+    leaves[0].trigger()
+    leaves[1].trigger()
+    leaves[6].trigger()
+    leaves[6].trigger()
+
+
+def run_reset():
+    '''One execution the way the examples observe a condition: reset, run, check'''
+    for condition in composites:
+        condition.reset()
+    sut()
+    return [condition.was_triggered for condition in composites]
+
+
+def run_session():
+    '''One execution the way the oracle observes conditions'''
+    with observation():
+        sut()
+        return [condition.was_triggered for condition in composites]
+
+
+def bench(number = 100_000):
+    for name, run in [('baseline', sut), ('reset', run_reset), ('session', run_session)]:
+        seconds = timeit(run, number=number)
+        print(f'{name}\t{seconds / number * 1e9:.0f} ns per execution')
+
+
+class CountingCondition:
+    '''The condition the instrumentation replaced: a plain counter on the object'''
+
+    def __init__(self) -> None:
+        self.triggered_count = 0
+
+    def trigger(self):
+        self.triggered_count += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *_):
+        if exc_type is not None:
+            self.trigger()
+
+
+counting = [CountingCondition() for _ in leaves]
+
+
+def hot_loop(conditions = leaves, iterations = 1_000):
+    '''A hot path of SUT code with instrumentation left in'''
+    total = 0
+    for i in range(iterations):
+        if i % 7 == 0:
+            conditions[9].trigger()
+        with conditions[10]:
+            total += i
+    return total
+
+
+def trigger_loop(conditions = leaves, iterations = 1_000):
+    '''A hot path that only triggers, without `with` blocks'''
+    total = 0
+    for i in range(iterations):
+        conditions[9].trigger()
+        total += i
+    return total
+
+
+def bare_loop(conditions = leaves, iterations = 1_000):
+    total = 0
+    for i in range(iterations):
+        if i % 7 == 0:
+            pass
+        total += i
+    return total
+
+
+def overhead(number = 500, repeats = 15):
+    '''Time added to a 1000-iteration loop by instrumentation: counting conditions as before
+    the bitmask, and conditions observed or disabled. The best of `repeats` runs is taken.
+
+    Python 3.12, best of 15 (microseconds added per loop; the bare loop takes 70-100):
+        hot loop     counting +325-345, observed +295-315, disabled +260-270
+        trigger loop counting  +25-35,  observed +150-175, disabled   +0-10
+    Disabled, a trigger costs next to nothing. What remains in the hot loop is the `with`
+    statement itself, which costs about as much with a `threading.Lock` as the context
+    manager. Observed, a trigger looks up its session and updates its count there.
+    '''
+    for loop in (hot_loop, trigger_loop):
+        bare = min(repeat(lambda: bare_loop(leaves), number=number, repeat=repeats)) / number
+        print(f'{loop.__name__}: uninstrumented\t{bare * 1e6:.1f} us per loop')
+        for name, conditions, switch in [
+            ('counting', counting, enable_observation),
+            ('observed', leaves, enable_observation),
+            ('disabled', leaves, disable_observation),
+        ]:
+            switch()
+            seconds = min(repeat(lambda: loop(conditions), number=number, repeat=repeats)) / number
+            print(f'{loop.__name__}: {name}\t{seconds * 1e6:.1f} us per loop (+{(seconds - bare) * 1e6:.1f})')
+        enable_observation()
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'bench'
+    match command:
+        case 'bench':
+            bench()
+        case 'overhead':
+            overhead()
+        case _:
+            print('Unknown command')
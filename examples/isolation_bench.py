@@ -0,0 +1,88 @@
+from isla.solver import ISLaSolver
+from isla.language import ISLaUnparser
+
+from string_theory.oracle import Oracle
+from string_theory.cache import LabelCache
+from string_theory.isolation import IsolatedOracle, Limits, recursion_exceeded, timed_out
+from string_theory.testing import ObservableTestSuite
+from string_theory.utils import generate_until_absolutely_cannot_anymore
+
+from itertools import islice
+from time import time
+
+import sys
+
+from xml_config.xml_config import CONFIG_GRAMMAR, ID_DEF_USE, NO_SELF_DEP
+from xml_config.wacky import Config as WackyConfig, ConfigError, bug_recursion_limit
+
+
+WackyConfig.injected_bug = bug_recursion_limit
+
+suite = ObservableTestSuite(
+    CONFIG_GRAMMAR,
+    ID_DEF_USE & -NO_SELF_DEP,
+    target_num_samples=50,
+    solver_deadline=30,
+    input_limits=Limits(seconds=1, recursion=200),
+)
+
+patterns = {
+    "String Existence",
+    "Existence String Fixed Length",
+    "Existence String Max Length",
+}
+
+
+@suite.observe(bug_recursion_limit, recursion_exceeded, learner_options={'activated_patterns': patterns})
+def test_build(input: str):
+    try:
+        WackyConfig.parse(input, strict=True).build()
+    except ConfigError:
+        pass
+
+
+def test_build_guarded(input: str):
+    '''The test as it has to be written to run in-process'''
+    try:
+        test_build(input)
+    except RecursionError:
+        pass
+
+
+def bench(n = 40, repeats = 5):
+    '''Labelling cost per input in-process, and in an isolated worker with a recursion budget'''
+    inputs = list(islice(generate_until_absolutely_cannot_anymore(ISLaSolver(CONFIG_GRAMMAR, ID_DEF_USE & -NO_SELF_DEP)), n))
+    conditions = [bug_recursion_limit, recursion_exceeded, timed_out]
+    print('oracle\tper input\ttriggered')
+    for name, make in [
+        ('in-process', lambda: Oracle(test_build_guarded, conditions[:1], str, cache=LabelCache(max_size=0))),
+        ('isolated', lambda: IsolatedOracle(test_build, conditions, str, Limits(seconds=1, recursion=200),
+                                       cache=LabelCache(max_size=0))),
+    ]:
+        with make() as oracle:
+            oracle.observe_all(inputs[:1])  # start the workers
+            start = time()
+            for _ in range(repeats):
+                outcomes = oracle.observe_all(inputs)
+            seconds = (time() - start) / repeats
+            triggered = [sum(outcome[i] for outcome in outcomes) for i in range(len(oracle.conditions))]
+            print(f'{name}\t{seconds / len(inputs) * 1e3:.2f} ms\t{triggered}')
+
+
+def learn(jobs: int | None = None):
+    '''Learn preconditions with every input run in an isolated worker, in-process or in a pool'''
+    for test, preconditions in suite.learn_preconditions(jobs=jobs, budget_seconds=600):
+        print(f'[{test.name}]')
+        for formula in preconditions:
+            print(ISLaUnparser(formula).unparse())
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'bench'
+    match command:
+        case 'bench':
+            bench()
+        case 'suite':
+            learn(int(sys.argv[2]) if len(sys.argv) > 2 else None)
+        case _:
+            print('Unknown command')
@@ -0,0 +1,36 @@
+from isla.solver import ISLaSolver
+
+from string_theory.sampler import GrammarSampler
+from string_theory.utils import generate_until_absolutely_cannot_anymore
+
+from itertools import islice
+from time import time
+
+import sys
+
+import simple_config
+from xml_config.xml_config import CONFIG_GRAMMAR, XML_GRAMMAR
+
+
+def bench(grammars = {'simple': simple_config.grammar, 'config': CONFIG_GRAMMAR, 'xml': XML_GRAMMAR}, n = 500):
+    '''Distinct unconstrained inputs per second, from the solver and from the sampler'''
+    print('grammar\tsolver\tsampler')
+    for name, grammar in grammars.items():
+        start = time()
+        solved = sum(1 for _ in islice(generate_until_absolutely_cannot_anymore(ISLaSolver(grammar)), n))
+        solver_rate = solved / (time() - start)
+
+        start = time()
+        sampled = sum(1 for _ in islice(GrammarSampler(grammar).distinct(), n))
+        sampler_rate = sampled / (time() - start)
+
+        print(f'{name}\t{solver_rate:.0f}/s\t{sampler_rate:.0f}/s')
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'bench'
+    match command:
+        case 'bench':
+            bench()
+        case _:
+            print('Unknown command')
@@ -8,7 +8,7 @@ from time import time
 
 from string_theory.condition import Condition
 from string_theory.testing import ObservableTestSuite
-from string_theory.utils import generate_with_retries, read_bnf
+from string_theory.utils import SupervisedGenerator, generate_with_retries, read_bnf
 
 from .correct import Config as CorrectConfig
 from .wacky import (
@@ -236,9 +236,12 @@ def eval_crash():
                 constraint = formula & constraint
             tests_to_failure = []
             times_to_failure = []
+            stalls = 0
             for _ in range(TESTS_PER_CONDITION):
-                solver = ISLaSolver(CONFIG_GRAMMAR, constraint)
-                inputs = generate_with_retries(solver)
+                # Z3 can hang far beyond the solver timeout, so solve in a process that can be killed
+                inputs = SupervisedGenerator(CONFIG_GRAMMAR, constraint, deadline=60, retries=True)
+                # build the child and its solver before the clock starts, as with the in-process solver
+                inputs.start()
                 console = Console()
 
                 start = time()
@@ -262,8 +265,12 @@ def eval_crash():
                 else:
                     tests_to_failure.append(None)
                     times_to_failure.append(None)
+                inputs.close()
+                stalls += inputs.stalls
             benchmarks.append((tests_to_failure, times_to_failure))
             print(tests_to_failure, times_to_failure, '\n', mean(tests_to_failure), mean(times_to_failure), '\n')
+            if stalls:
+                print(f'{stalls} solver stalls')
             # if all(n == 1 for n in tests_to_failure):
             #     break
 
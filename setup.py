@@ -8,5 +8,6 @@ setup(
     author='Marko',
     author_email='m.a.vasylenko@student.utwente.nl',
     description='ISLa generative testing',
-    install_requires=['isla-solver', 'islearn']
+    install_requires=['isla-solver', 'islearn'],
+    extras_require={'stats': ['numpy']},
 )
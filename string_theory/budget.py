@@ -0,0 +1,48 @@
+from typing import Self
+from time import monotonic
+
+
+class Budget:
+    '''A wall-clock allowance for a piece of work, optionally nested in a parent budget.
+
+    Work polls `should_stop()` at points where it can stop cleanly; a budget remembers
+    whether it actually cut work short, so partial results can be marked as such, and
+    whether it shortened a solver timeout (`capped`), which may end work without a poll.
+    '''
+
+    def __init__(self, seconds: float | None = None, parent: 'Budget | None' = None) -> None:
+        self.deadline = monotonic() + seconds if seconds is not None else None
+        self.parent = parent
+        self.cancelled = False
+        self.interrupted = False
+        self.capped = False
+
+    def child(self, seconds: float | None = None) -> Self:
+        return Budget(seconds, parent=self)
+
+    def cancel(self):
+        self.cancelled = True
+
+    @property
+    def remaining(self) -> float:
+        remaining = float('inf') if self.deadline is None else max(0.0, self.deadline - monotonic())
+        if self.parent is not None:
+            remaining = min(remaining, self.parent.remaining)
+        return 0.0 if self.cancelled else remaining
+
+    @property
+    def exhausted(self) -> bool:
+        return self.remaining <= 0
+
+    def should_stop(self) -> bool:
+        if self.exhausted:
+            self.interrupted = True
+        return self.interrupted
+
+    def timeout(self, seconds: int | None = None) -> int | None:
+        '''A solver timeout of `seconds`, capped to what is left of the budget (but at least a second)'''
+        requested = seconds if seconds is not None else float('inf')
+        limit = min(requested, self.remaining)
+        if limit < requested:
+            self.capped = True
+        return None if limit == float('inf') else max(1, int(limit))
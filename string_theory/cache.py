@@ -0,0 +1,215 @@
+from isla.type_defs import Grammar
+from isla.derivation_tree import DerivationTree
+from isla.language import Formula, ISLaUnparser
+
+from collections import OrderedDict
+from types import CodeType
+from typing import Callable, Iterable, Sequence
+
+import hashlib
+import json
+import os
+import sqlite3
+
+from .condition import Condition
+
+
+def code_digest(code: CodeType) -> str:
+    '''Hash of a code object that changes whenever its bytecode, constants or referenced names change.
+
+    Stable across processes: set constants are hashed in sorted order, so the digest does not
+    depend on PYTHONHASHSEED.
+    '''
+    digest = hashlib.sha256(code.co_code)
+    digest.update('\0'.join(code.co_names).encode())
+    for const in code.co_consts:
+        digest.update(b'\0' + _stable_repr(const).encode())
+    return digest.hexdigest()
+
+
+def _stable_repr(const: object) -> str:
+    if isinstance(const, CodeType):
+        return code_digest(const)
+    if isinstance(const, frozenset):
+        return 'frozenset({' + ', '.join(sorted(_stable_repr(c) for c in const)) + '})'
+    if isinstance(const, tuple):
+        return '(' + ', '.join(_stable_repr(c) for c in const) + ',)'
+    return repr(const)
+
+
+def function_fingerprint(func: Callable) -> str:
+    '''`module.name:bytecode-hash` of a function, the same in every run and every process'''
+    return f'{func.__module__}.{func.__qualname__}:{code_digest(func.__code__)}'
+
+
+def test_identity(test_func: Callable, conditions: Sequence[Condition] = ()) -> str:
+    '''`module.name[conditions]:bytecode-hash` of a test function observing the given conditions'''
+    observed = '|'.join(str(c.description) for c in conditions)
+    return f'{test_func.__module__}.{test_func.__qualname__}[{observed}]:{code_digest(test_func.__code__)}'
+
+
+def fingerprint(
+    grammar: Grammar,
+    formula: Formula | None,
+    test_func: Callable,
+    conditions: Sequence[Condition] = (),
+) -> str:
+    parts = [
+        json.dumps(grammar, sort_keys=True),
+        ISLaUnparser(formula).unparse() if formula is not None else '',
+        function_fingerprint(test_func),
+        *(str(c.description) for c in conditions),
+    ]
+    return hashlib.sha256('\0'.join(parts).encode()).hexdigest()
+
+
+class SampleCache:
+    '''Labelled sample sets stored on disk, one JSON file per fingerprint'''
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.json')
+
+    def load(self, key: str) -> list[tuple[DerivationTree, tuple[bool, ...]]]:
+        try:
+            with open(self.path(key), 'r') as f:
+                entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return []
+
+        return [(DerivationTree.from_parse_tree(tree), tuple(outcome)) for tree, outcome in entries]
+
+    def store(self, key: str, samples: Iterable[tuple[DerivationTree, tuple[bool, ...]]]):
+        entries = [(tree.to_parse_tree(), outcome) for tree, outcome in samples]
+
+        # write to a temporary file first, so a crash never leaves a truncated entry behind
+        temporary = self.path(key) + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(entries, f)
+        os.replace(temporary, self.path(key))
+
+
+class LabelCache:
+    '''Outcomes of test runs, keyed by test identity and input string.
+
+    The `max_size` most recently used outcomes are kept in memory. With a `path`, outcomes
+    are also persisted in an SQLite database; persisted outcomes of a test are dropped as
+    soon as the test's bytecode no longer matches the one they were recorded with. New
+    outcomes are written on `flush()`, in one short transaction, so that several processes
+    can share the database; every process opens its own connection.
+    '''
+
+    def __init__(self, max_size: int = 100_000, path: str | None = None) -> None:
+        self.max_size = max_size
+        self.path = path
+        self.entries: OrderedDict[tuple[str, str], tuple[tuple[bool, ...], float]] = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+        self._db: sqlite3.Connection | None = None
+        self._pid: int | None = None
+        self._unwritten: list[tuple[str, str, str, str, float]] = []
+        self._validated: set[str] = set()
+
+    @property
+    def db(self) -> sqlite3.Connection | None:
+        if self.path is None:
+            return None
+        if self._pid != os.getpid():
+            if self._db is not None:
+                # a connection inherited through fork must not be used, nor closed: closing it
+                # would drop locks and files that the parent still relies on
+                _inherited.append(self._db)
+            self._db = sqlite3.connect(self.path, timeout=30)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS outcomes ('
+                'name TEXT, identity TEXT, input TEXT, outcome TEXT, cost REAL, '
+                'PRIMARY KEY (identity, input))'
+            )
+            self._db.commit()
+            self._pid = os.getpid()
+            self._unwritten = []
+            self._validated = set()
+        return self._db
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, identity: str, input: str) -> tuple[bool, ...] | None:
+        key = identity, input
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        elif self.path is not None:
+            self._invalidate_stale(identity)
+            row = self.db.execute(
+                'SELECT outcome, cost FROM outcomes WHERE identity = ? AND input = ?', key
+            ).fetchone()
+            if row is not None:
+                entry = tuple(json.loads(row[0])), row[1]
+                self._remember(key, entry)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.saved_seconds += entry[1]
+        return entry[0]
+
+    def put(self, identity: str, input: str, outcome: tuple[bool, ...], cost: float = 0.0):
+        key = identity, input
+        self._remember(key, (outcome, cost))
+        if self.path is not None:
+            self._invalidate_stale(identity)
+            self._unwritten.append((_name_of(identity), identity, input, json.dumps(outcome), cost))
+
+    def flush(self):
+        if self.path is None or not self._unwritten:
+            return
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO outcomes VALUES (?, ?, ?, ?, ?)', self._unwritten)
+        self._unwritten = []
+
+    def close(self):
+        if self._db is not None and self._pid == os.getpid():
+            self.flush()
+            self._db.close()
+        self._db = None
+        self._pid = None
+
+    def __getstate__(self):
+        # every process keeps its own memory and opens its own connection
+        return {'max_size': self.max_size, 'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _remember(self, key: tuple[str, str], entry: tuple[tuple[bool, ...], float]):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def _invalidate_stale(self, identity: str):
+        db = self.db
+        if identity in self._validated:
+            return
+        with db:
+            db.execute('DELETE FROM outcomes WHERE name = ? AND identity != ?', (_name_of(identity), identity))
+        self._validated.add(identity)
+
+
+_inherited: list[sqlite3.Connection] = []
+
+
+def _name_of(identity: str) -> str:
+    return identity.rsplit(':', 1)[0]
@@ -1,16 +1,63 @@
-from typing import Self
+from typing import Callable, Self, Iterator
+from importlib import import_module
+from contextvars import ContextVar
+from contextlib import contextmanager
+from itertools import count
+from pickle import PicklingError
+
+import os
+import sys
+
+
+_bits = count()
+
+def _register() -> int:
+    '''A bit of its own for a new leaf condition'''
+    return 1 << next(_bits)
+
+
+class TriggerState:
+    '''Which conditions were triggered, and how often.
+
+    Every leaf condition owns one bit of `mask`; its count in `counts` is only valid
+    while that bit is set, so resetting any set of conditions just clears their bits.
+    '''
+
+    __slots__ = ('mask', 'counts')
+
+    def __init__(self) -> None:
+        self.mask = 0
+        self.counts: dict[Condition, int] = {}
+
+    def count(self, condition: 'Condition') -> int:
+        return self.counts[condition] if self.mask & condition._bit else 0
+
+    def clear(self):
+        self.mask = 0
+
+
+_global_state = TriggerState()
+
 
 class Condition:
     def __init__(self, description: str | int) -> None:
         self.description = description
-        self._triggered_count = 0
-    
+        self._bit = _register()
+        self._module = sys._getframe(1).f_globals.get('__name__')
+
     def trigger(self):
-        self._triggered_count += 1
-    
+        state = _session.get(_global_state)
+        counts = state.counts
+        if state.mask & self._bit:
+            counts[self] += 1
+        else:
+            state.mask |= self._bit
+            counts[self] = 1
+
     def reset(self):
-        self._triggered_count = 0
-    
+        state = _session.get(_global_state)
+        state.mask &= ~self._leaf_mask
+
     def describe(self, description) -> Self:
         '''Update the condition's description'''
         self.description = description
@@ -18,78 +65,238 @@ class Condition:
 
     @property
     def was_triggered(self):
-        return self._triggered_count > 0
-    
+        state = _session.get(_global_state)
+        return state.mask & self._bit != 0
+
     @property
     def count(self):
-        return self._triggered_count
-    
+        state = _session.get(_global_state)
+        return state.count(self)
+
+    @property
+    def _leaf_mask(self) -> int:
+        return self._bit
+
+    def _expression(self) -> str:
+        '''A Python expression over `mask` that is true iff the condition was triggered'''
+        return f'mask & {self._bit} != 0'
+
     def __and__(self, other):
         return ConjunctiveCondition(self, other)
 
     def __or__(self, other):
         return DisjunctiveCondition(self, other)
-    
+
     def __invert__(self):
         return NegatedCondition(self)
-    
+
     def __enter__(self):
         return self
-    
-    def __exit__(self, exc_type, *_):
+
+    def __exit__(self, exc_type, exc, traceback):
         if exc_type is not None:
             self.trigger()
 
+    _trigger = trigger
+    _enter = __enter__
+    _exit = __exit__
 
+    def __reduce_ex__(self, protocol):
+        '''Module-level conditions are pickled by their module-qualified name, so that
+        a worker process observes the same object that the system under test triggers.
+        Any other leaf condition would be a copy that nothing triggers, so it does not pickle.'''
+        name = self.qualified_name
+        if name is not None:
+            return _lookup, name
+        if getattr(self, '_module', None) is not None:
+            raise PicklingError(f'Condition {self.description!r} must be a global of module {self._module} '
+                                'to be observed in another process')
+        return super().__reduce_ex__(protocol)
 
-class NegatedCondition(Condition):
-    def __init__(self, condition: Condition) -> None:
-        self.condition = condition
-        self.description = f'Not ({condition.description})'
+    def __setstate__(self, state):
+        # bits are only unique within a process
+        self.__dict__.update(state)
+        if '_bit' in state:
+            self._bit = _register()
 
-    def reset(self):
-        return self.condition.reset()
-    
-    @property
-    def was_triggered(self):
-        return not self.condition.was_triggered
-    
     @property
-    def count(self):
-        return int(self.was_triggered)
+    def qualified_name(self) -> tuple[str, str] | None:
+        module = sys.modules.get(getattr(self, '_module', None))
+        if module is None:
+            return None
+        for name, value in vars(module).items():
+            if value is self:
+                return module.__name__, name
+        return None
 
-    def trigger(self):
-        raise Exception('Negation conditions cannot be triggered')
 
-class ConjunctiveCondition(Condition):
-    def __init__(self, *conditions: Condition):
-        self.sub_conditions = conditions
-    
+def _lookup(module: str, name: str) -> Condition:
+    return getattr(import_module(module), name)
+
+
+def reset_all():
+    '''Reset every condition in the current observation session (or outside of any)'''
+    _session.get(_global_state).clear()
+
+
+_observing = True
+
+def observing() -> bool:
+    return _observing
+
+
+def disable_observation():
+    '''Turn `trigger` and `with condition:` into no-ops, e.g. for SUT code running in production.
+    Opening an observation session turns observation back on.
+
+    The methods are swapped on the class, so a disabled condition costs one empty call and no
+    session lookup; what remains of a `with condition:` block is the `with` statement itself.'''
+    global _observing
+    _observing = False
+    Condition.trigger = _ignore
+    Condition.__enter__ = _ignore_enter
+    Condition.__exit__ = _ignore_exit
+
+
+def enable_observation():
+    global _observing
+    _observing = True
+    Condition.trigger = Condition._trigger
+    Condition.__enter__ = Condition._enter
+    Condition.__exit__ = Condition._exit
+
+
+def _ignore(self):
+    pass
+
+
+def _ignore_enter(self):
+    return self
+
+
+def _ignore_exit(self, exc_type, exc, traceback):
+    pass
+
+
+_session: ContextVar[TriggerState | None] = ContextVar('observation_session', default=None)
+
+@contextmanager
+def observation() -> Iterator[TriggerState]:
+    '''Open an observation session: until the block exits, conditions triggered in the
+    current thread or asyncio task are counted apart from every other session and from
+    the conditions' own counters.
+
+    Nested sessions start empty; the enclosing session is restored on exit.
+    '''
+    if not _observing:
+        enable_observation()
+    token = _session.set(TriggerState())
+    try:
+        yield _session.get()
+    finally:
+        _session.reset(token)
+
+
+class CompositeCondition(Condition):
+    '''A condition over other conditions. It is compiled once, on first use, into a single
+    expression over the bitmask of triggered leaves, and resets all its leaves at once.'''
+
+    _compiled: tuple[int, Callable[[int], bool]] | None = None
+
     def trigger(self):
         raise Exception('Combination conditions cannot be triggered')
-    
-    def reset(self):
-        for cond in self.sub_conditions:
-            cond.reset()
 
     @property
     def was_triggered(self) -> bool:
-        return all(c.was_triggered for c in self.sub_conditions)
-    
+        compiled = self._compiled
+        if compiled is None:
+            compiled = self._compile()
+        state = _session.get(_global_state)
+        return compiled[1](state.mask)
+
     @property
     def count(self) -> int:
         return int(self.was_triggered)
-    
+
+    @property
+    def _leaf_mask(self) -> int:
+        compiled = self._compiled
+        if compiled is None:
+            compiled = self._compile()
+        return compiled[0]
+
+    def _compile(self) -> tuple[int, Callable[[int], bool]]:
+        self._compiled = self._collect_mask(), eval(f'lambda mask: {self._expression()}')
+        return self._compiled
+
+    def _children(self) -> tuple[Condition, ...]:
+        '''The conditions this one is composed of'''
+        return ()
+
+    def _collect_mask(self) -> int:
+        mask = 0
+        for child in self._children():
+            mask |= child._leaf_mask
+        return mask
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_compiled', None)
+        return state
+
+
+def leaves(condition: Condition) -> Iterator[Condition]:
+    '''The leaf conditions a condition is composed of'''
+    if isinstance(condition, CompositeCondition):
+        for child in condition._children():
+            yield from leaves(child)
+    else:
+        yield condition
+
+
+class NegatedCondition(CompositeCondition):
+    def __init__(self, condition: Condition) -> None:
+        self.condition = condition
+        self.description = f'Not ({condition.description})'
+
+    def trigger(self):
+        raise Exception('Negation conditions cannot be triggered')
+
+    def _children(self) -> tuple[Condition, ...]:
+        return self.condition,
+
+    def _expression(self) -> str:
+        return f'not ({self.condition._expression()})'
+
+
+class ConjunctiveCondition(CompositeCondition):
+    def __init__(self, *conditions: Condition):
+        self.sub_conditions = conditions
+
+    def _children(self) -> tuple[Condition, ...]:
+        return self.sub_conditions
+
+    def _expression(self) -> str:
+        if all(type(c) is Condition for c in self.sub_conditions):
+            mask = self._collect_mask()
+            return f'mask & {mask} == {mask}'
+        return ' and '.join(f'({c._expression()})' for c in self.sub_conditions)
+
     @property
     def description(self) -> str:
         return ' and '.join(c.description for c in self.sub_conditions)
 
 
 class DisjunctiveCondition(ConjunctiveCondition):
-    @property
-    def was_triggered(self):
-        return any(c.was_triggered for c in self.sub_conditions)
-    
+    def _expression(self) -> str:
+        if all(type(c) is Condition for c in self.sub_conditions):
+            return f'mask & {self._collect_mask()} != 0'
+        return ' or '.join(f'({c._expression()})' for c in self.sub_conditions)
+
     @property
     def description(self) -> str:
         return ' or '.join(c.description for c in self.sub_conditions)
+
+
+if os.environ.get('STRING_THEORY_OBSERVE', '1') == '0':
+    disable_observation()
@@ -0,0 +1,128 @@
+from isla.derivation_tree import DerivationTree
+
+from types import CodeType, ModuleType
+from typing import Any, Callable, Iterable, Self
+
+import os
+import sys
+
+from .condition import Condition, leaves
+from .oracle import ConditionOracle
+
+
+Location = tuple[CodeType, int, int]
+
+
+class CoverageTracker:
+    '''Records which lines and branches of the code under `roots` a call executes, using
+    `sys.monitoring`. Every location is reported at most once per run and then disabled,
+    so code that has been seen costs nothing until the next run.
+
+    Unless a `tool_id` is given, the tracker takes the first one no other tool (such as
+    coverage.py, which holds `COVERAGE_ID`) is using.'''
+
+    def __init__(self, roots: Iterable[str], tool_id: int | None = None) -> None:
+        if not hasattr(sys, 'monitoring'):
+            raise RuntimeError('Coverage tracking requires sys.monitoring (Python 3.12 or later)')
+        self.monitoring = sys.monitoring
+        self.roots = tuple(os.path.abspath(root) + os.sep for root in roots)
+        self.tool_id = tool_id
+        self._acquired: int | None = None
+        self.current: set[Location] = set()
+        self._included: dict[CodeType, bool] = {}
+
+    @classmethod
+    def for_function(cls, func: Callable) -> Self:
+        '''Track the code that lives next to `func`'''
+        return cls([os.path.dirname(func.__code__.co_filename)])
+
+    @classmethod
+    def for_test(cls, func: Callable, conditions: Iterable[Condition]) -> Self:
+        '''Track the code that lives next to `func`, and next to the modules that define the
+        conditions, which are usually part of the system under test'''
+        roots = {os.path.dirname(func.__code__.co_filename)}
+        for condition in conditions:
+            for leaf in leaves(condition):
+                module = sys.modules.get(getattr(leaf, '_module', None))
+                if getattr(module, '__file__', None) is not None:
+                    roots.add(os.path.dirname(module.__file__))
+        return cls(sorted(roots))
+
+    def includes(self, code: CodeType) -> bool:
+        included = self._included.get(code)
+        if included is None:
+            filename = os.path.abspath(code.co_filename)
+            included = self._included[code] = filename.startswith(self.roots)
+        return included
+
+    def _line(self, code: CodeType, line: int):
+        if self.includes(code):
+            self.current.add((code, line, -1))
+        return self.monitoring.DISABLE
+
+    def _branch(self, code: CodeType, offset: int, destination: int):
+        if self.includes(code):
+            self.current.add((code, offset, destination))
+        return self.monitoring.DISABLE
+
+    def run(self, func: Callable, *args) -> tuple[Any, frozenset[Location]]:
+        '''Call `func` and return its result along with the locations it executed'''
+        self.current = set()
+        self.monitoring.restart_events()
+        try:
+            return func(*args), frozenset(self.current)
+        finally:
+            self.current = set()
+
+    def __enter__(self) -> Self:
+        monitoring = self.monitoring
+        tool_id = self.tool_id if self.tool_id is not None else _free_tool_id(monitoring)
+        monitoring.use_tool_id(tool_id, 'string_theory')
+        self._acquired = tool_id
+        monitoring.register_callback(tool_id, monitoring.events.LINE, self._line)
+        monitoring.register_callback(tool_id, monitoring.events.BRANCH, self._branch)
+        monitoring.set_events(tool_id, monitoring.events.LINE | monitoring.events.BRANCH)
+        return self
+
+    def __exit__(self, *_):
+        monitoring = self.monitoring
+        tool_id, self._acquired = self._acquired, None
+        monitoring.set_events(tool_id, monitoring.events.NO_EVENTS)
+        monitoring.register_callback(tool_id, monitoring.events.LINE, None)
+        monitoring.register_callback(tool_id, monitoring.events.BRANCH, None)
+        monitoring.free_tool_id(tool_id)
+
+
+def _free_tool_id(monitoring: ModuleType) -> int:
+    # ids 3 and 4 have no conventional owner; the others only if their owner is absent
+    for tool_id in (3, 4, monitoring.OPTIMIZER_ID, monitoring.PROFILER_ID, monitoring.COVERAGE_ID, monitoring.DEBUGGER_ID):
+        if monitoring.get_tool(tool_id) is None:
+            return tool_id
+    raise RuntimeError('No free sys.monitoring tool id for coverage tracking')
+
+
+class CoverageGuide:
+    '''Labels inputs in-process while tracking the coverage of the test function and of the
+    modules its conditions live in, and keeps every input that reached code no earlier input
+    did as a seed for further mutation.'''
+
+    def __init__(self, oracle: ConditionOracle, tracker: CoverageTracker | None = None) -> None:
+        self.oracle = oracle
+        self.tracker = tracker or CoverageTracker.for_test(oracle.oracle.test_func, oracle.oracle.conditions)
+        self.covered: set[Location] = set()
+        self.seeds: list[DerivationTree] = []
+        self.runs = 0
+
+    def label(self, inputs: Iterable[DerivationTree]) -> list[bool]:
+        labels = []
+        with self.tracker:
+            for input in inputs:
+                outcome, coverage = self.tracker.run(self.oracle.oracle.run, input)
+                self.oracle.oracle.record(input, outcome)
+                self.runs += 1
+
+                if not coverage <= self.covered:
+                    self.covered |= coverage
+                    self.seeds.append(input)
+                labels.append(outcome[self.oracle.index])
+        return labels
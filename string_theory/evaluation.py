@@ -44,42 +44,98 @@ def format_pss(data: PrecAndSampleSize) -> str:
     return f'{precision}% ({sample_size} sample)'
 
 
-def evaluate(suite: ObservableTestSuite, output_file: str):
+def evaluate(
+    suite: ObservableTestSuite,
+    output_file: str,
+    budget_seconds: float | None = None,
+    test_budget_seconds: float | None = None,
+    tolerance: float | None = None,
+    confidence: float = 0.95,
+):
     file = open(output_file, 'a+', newline='')
     result_log = writer(file, quoting=QUOTE_STRINGS)
 
     print('Learning preconditions')
-    suite.learn_preconditions()
+    suite.learn_preconditions(budget_seconds=budget_seconds, test_budget_seconds=test_budget_seconds)
 
     print('Evaluating preconditions')
     current_test = None
     measured = 0
     timed_out = 0
-    result_log.writerow(['Test name', 'Precondition', 'Raw accuracy', 'Resulting accuracy', 'Measured'])
-    for test, precondition, raw_p, raw_n, res_p, res_n in suite.results_accuracy(100):
+    result_log.writerow(['Test name', 'Precondition', 'Raw accuracy', 'Resulting accuracy', 'Measured', 'Budget exhausted',
+                         'Raw interval low', 'Raw interval high', 'Raw samples',
+                         'Resulting interval low', 'Resulting interval high', 'Resulting samples',
+                         'Generation', 'Recall', 'Equivalent to'])
+    results = suite.results_accuracy(100, budget_seconds=budget_seconds, test_budget_seconds=test_budget_seconds,
+                                     tolerance=tolerance, confidence=confidence)
+    for result in results:
+        test = result.test
         if test is not current_test:
             current_test = test
             print(f'\n[Test] {test.name} ({test.condition.description})')
-        precondition_code = ISLaUnparser(precondition).unparse()
+        precondition_code = ISLaUnparser(result.precondition).unparse()
+        equivalent_code = ISLaUnparser(result.equivalent_to).unparse() if result.equivalent_to is not None else None
 
-        if (raw_p is None):
-            result_log.writerow([test.name, precondition_code, 0, 0, False])
+        if not result.measured:
+            result_log.writerow([test.name, precondition_code, 0, 0, False, result.budget_exhausted, 0, 0, 0, 0, 0, 0,
+                                 result.generation_mode, None, equivalent_code])
             # print("Couldn't generate enough solutions to evaluate, likely due to a timeout.\n")
             timed_out += 1
             continue
 
         measured += 1
 
-        raw_acc = len(raw_p) / (len(raw_p) + len(raw_n)) * 100
-        res_acc = len(res_p) / (len(res_p) + len(res_n)) * 100
-        print(f'- Found precondition (accuracy {raw_acc}% -> {res_acc}%)')
+        raw_acc = result.raw_accuracy * 100
+        res_acc = result.res_accuracy * 100
+        raw_low, raw_high = (bound * 100 for bound in result.raw_interval)
+        res_low, res_high = (bound * 100 for bound in result.res_interval)
+        print(f'- Found precondition (accuracy {raw_acc}% -> {res_acc}%, '
+              f'{res_low:.1f}-{res_high:.1f}% over {result.res_samples} samples, {result.generation_mode})')
         print(precondition_code)
-        result_log.writerow([test.name, precondition_code, raw_acc, res_acc, True])
+        if equivalent_code is not None:
+            print('(equivalent on the learning samples to a precondition measured above)')
+        result_log.writerow([test.name, precondition_code, raw_acc, res_acc, True, result.budget_exhausted,
+                             raw_low, raw_high, result.raw_samples, res_low, res_high, result.res_samples,
+                             result.generation_mode, result.recall, equivalent_code])
     
     file.close()
     print('Measured', measured, 'and timed out', timed_out, 'preconditions')
 
 
+def evaluate_matrix(
+    suite: ObservableTestSuite,
+    output_file: str,
+    num_samples: int = 1000,
+    resamples: int = 1000,
+    confidence: float = 0.95,
+    budget_seconds: float | None = None,
+):
+    '''Like `evaluate`, but measures all preconditions on one labelled corpus at once and
+    reports bootstrap intervals of their precision and recall (requires numpy)'''
+    print('Learning preconditions')
+    suite.learn_preconditions(budget_seconds=budget_seconds)
+
+    print('Labelling corpus')
+    matrix, pairs = suite.label_matrix(num_samples, budget_seconds=budget_seconds)
+    confusion = matrix.confusion()
+    precision, recall = matrix.precision(), matrix.recall()
+    precision_ci, recall_ci = matrix.bootstrap(resamples, confidence)
+    base_rates = matrix.base_rates()[matrix.owners]
+
+    with open(output_file, 'a+', newline='') as file:
+        result_log = writer(file, quoting=QUOTE_STRINGS)
+        result_log.writerow(['Test name', 'Precondition', 'Raw accuracy', 'True positives', 'False positives',
+                             'False negatives', 'True negatives', 'Precision', 'Precision low', 'Precision high',
+                             'Recall', 'Recall low', 'Recall high'])
+        for column, (test, precondition) in enumerate(pairs):
+            result_log.writerow([
+                test.name, ISLaUnparser(precondition).unparse(), base_rates[column], *confusion[column].tolist(),
+                precision[column], *precision_ci[column].tolist(), recall[column], *recall_ci[column].tolist(),
+            ])
+
+    print('Measured', len(pairs), 'preconditions on', matrix.num_samples, 'samples')
+
+
 def dump_preconditions(suite: ObservableTestSuite, path):
     results = suite.learn_preconditions()
     dump = []
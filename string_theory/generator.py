@@ -1,42 +1,59 @@
-from isla.solver import ISLaSolver
 from isla.language import Formula
 from isla.type_defs import Grammar
 from isla.derivation_tree import DerivationTree
 
 from typing import Callable, Self
-from itertools import chain
+from time import perf_counter
+
+from .pool import SamplePool
+from .solvers import SolverFactory, default_factory
+from .scheduler import MutationScheduler, RoundStats
 
 class InputGenerator:
-    def __init__(self, grammar: Grammar, formula: Formula | None, *, debug = lambda i: ...) -> None:
+    def __init__(
+        self,
+        grammar: Grammar,
+        formula: Formula | None,
+        *,
+        debug = lambda i: ...,
+        solvers: SolverFactory = default_factory,
+    ) -> None:
         self.grammar = grammar
         self.formula = formula
         self.debug = debug
+        self.solvers = solvers
 
     def with_formula(self, formula) -> Self:
         self.formula = formula
         return self
     
     def naive(self, num_samples: int = 1):
-        isla_solver = ISLaSolver(grammar=self.grammar, formula=self.formula)
+        isla_solver = self.solvers.solver(grammar=self.grammar, formula=self.formula)
+        pool = SamplePool()
         for _ in range(num_samples):
-            yield isla_solver.solve()
+            sample = isla_solver.solve()
+            if pool.add(sample):
+                yield sample
 
     def mutated(self, num_samples: int):
         mutation_ratio = 5
-        isla_solver = ISLaSolver(grammar=self.grammar, formula=self.formula)
+        isla_solver = self.solvers.solver(grammar=self.grammar, formula=self.formula)
 
+        pool = SamplePool()
         generated = []
         for _ in range(num_samples // mutation_ratio):
             sample = isla_solver.solve()
-            yield sample
-            generated.append(sample)
+            if pool.add(sample):
+                yield sample
+                generated.append(sample)
         
         for _ in range(mutation_ratio - 1):
             mutated = []
             for sample in generated:
                 mutant = isla_solver.mutate(sample)
-                yield mutant
-                mutated.append(mutant)
+                if pool.add(mutant):
+                    yield mutant
+                    mutated.append(mutant)
             generated = mutated
     
     def discriminate_with_mutation(
@@ -46,7 +63,7 @@ class InputGenerator:
             num_tries: int = 5,
         ):
         self.debug('Fuzzing samples', end='... ')
-        self.solver = ISLaSolver(
+        self.solver = self.solvers.solver(
             grammar=self.grammar,
             formula=self.formula,
             enable_optimized_z3_queries=False,
@@ -55,46 +72,45 @@ class InputGenerator:
             # max_number_tree_insertion_results=20,
         )
 
-        positive_examples = []
-        negative_examples = []
+        pool = SamplePool()
 
-        initial_target = self.target_num_samples // 5
+        initial_target = target_samples // 5
 
         for _ in range(num_tries):
-            if len(positive_examples) > initial_target and len(negative_examples) > initial_target:
+            if len(pool.positive) > initial_target and len(pool.negative) > initial_target:
                 break
             
             try:
                 sample = self.solver.solve()
-                if property(sample):
-                    positive_examples.append(sample)
-                else:
-                    negative_examples.append(sample)
+                if pool.add(sample):
+                    pool.label(sample, prop(sample))
             except StopIteration:
                 break
 
         # print(f'so far p {len(positive_examples)} n {len(negative_examples)}')
         # print('mutating')
-        tried = 0
-        while len(positive_examples) < self.target_num_samples and tried < num_tries:
-            if len(positive_examples) == 0:
+        scheduler = MutationScheduler()
+        for sample in pool:
+            scheduler.offer(sample)
+
+        while len(pool.positive) < target_samples and scheduler.should_continue():
+            if len(pool.positive) == 0:
                 self.debug('no positive examples to mutate', end='... ')
                 break
 
-            new_positive = []
-            new_negative = []
+            start = perf_counter()
+            seeds = scheduler.next_seeds()
+            mutants = pool.extend(self.solver.mutate(sample) for sample in seeds)
 
-            all_examples = chain(iter(positive_examples), iter(negative_examples))
-            for sample in all_examples:
-                mutant = self.solver.mutate(sample)
-                if property(mutant):
-                    new_positive.append(mutant)
-                else:
-                    new_negative.append(mutant)
+            labels = [prop(mutant) for mutant in mutants]
+            for mutant, label in zip(mutants, labels):
+                pool.label(mutant, label)
+                scheduler.offer(mutant)
 
-            positive_examples.extend(new_positive)
-            negative_examples.extend(new_negative)
+            positive = sum(labels)
+            scheduler.record(RoundStats(len(seeds), positive, len(labels) - positive, len(seeds) - len(mutants), perf_counter() - start))
         
+        positive_examples, negative_examples = pool.positive, pool.negative
         self.debug(f'came up with {len(positive_examples)} positive and {len(negative_examples)} negative')
         self.debug(f'p example: {positive_examples[len(positive_examples) // 2]}')
         self.debug(f'n example: {negative_examples[len(negative_examples) // 2]}')
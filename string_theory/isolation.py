@@ -0,0 +1,249 @@
+from isla.derivation_tree import DerivationTree
+from isla.type_defs import ParseTree
+
+from collections import Counter, deque
+from dataclasses import dataclass
+from multiprocessing.connection import Connection, wait
+from typing import Any, Callable, Iterable, Sequence
+from time import perf_counter
+
+import multiprocessing
+import resource
+import signal
+import sys
+
+from .condition import Condition, TriggerState, observation
+from .oracle import Oracle, Outcome
+from .cache import LabelCache
+
+
+timed_out = Condition('Input exceeded its wall-time budget')
+out_of_memory = Condition('Input exceeded its memory budget')
+recursion_exceeded = Condition('Input exceeded its recursion budget')
+crashed = Condition('Test process died')
+
+_violations = {'time': timed_out, 'memory': out_of_memory, 'recursion': recursion_exceeded, 'crash': crashed}
+
+
+@dataclass(frozen=True)
+class Limits:
+    '''What the test may use on a single input: `seconds` of wall-clock time, `memory` bytes of
+    address space on top of what its worker process uses when the input starts, and `recursion`
+    stack frames.
+    A run the worker cannot interrupt is killed `grace` seconds after its time is up.'''
+    seconds: float | None = None
+    memory: int | None = None
+    recursion: int | None = None
+    grace: float = 1.0
+
+
+class IsolatedOracle(Oracle):
+    '''An oracle that runs the test in warm worker processes, each input within `limits`.
+
+    Workers are forked from a fork server that imports the test's module once, so like the
+    workers of any oracle they only see the parent's `configuration` of the system under test,
+    not other changes made at runtime. A run that exceeds its time, memory or stack budget
+    is stopped and reported as an outcome: it triggers `timed_out`, `out_of_memory` or
+    `recursion_exceeded`, and a run that kills its worker triggers `crashed`. Observe these like any other condition; `violations` counts
+    them by budget. Runs stopped by an exception keep the conditions the exception triggered;
+    runs stopped by the clock only keep those triggered before.
+    '''
+
+    def __init__(
+        self,
+        test_func: Callable[[Any], Any],
+        conditions: Sequence[Condition],
+        convert_input: Callable[[DerivationTree], Any],
+        limits: Limits,
+        jobs: int | None = None,
+        cache: LabelCache | None = None,
+    ) -> None:
+        super().__init__(test_func, conditions, convert_input, jobs, cache)
+        self.limits = limits
+        self.violations: Counter[str] = Counter()
+        self._workers: list[_Worker] = []
+
+    def workers(self, count: int) -> list['_Worker']:
+        while len(self._workers) < count:
+            self._workers.append(_Worker(self))
+        return self._workers[:count]
+
+    def _runs(self, inputs: list[DerivationTree]) -> Iterable[tuple[Outcome, float]]:
+        self.check_configuration()
+        runs: list[tuple[Outcome, float] | None] = [None] * len(inputs)
+        waiting = deque(enumerate(inputs))
+        idle = self.workers(min(len(inputs), max(1, self.jobs or 1)))
+        busy: dict[Connection, tuple[_Worker, int, float]] = {}
+        while waiting or busy:
+            while idle and waiting:
+                worker = idle.pop()
+                index, input = waiting.popleft()
+                worker.connection.send(input.to_parse_tree())
+                busy[worker.connection] = worker, index, perf_counter()
+
+            timeout = None
+            if self.limits.seconds is not None:
+                oldest = min(start for _, _, start in busy.values())
+                timeout = max(0.0, oldest + self.limits.seconds + self.limits.grace - perf_counter())
+
+            for connection in wait(list(busy), timeout):
+                worker, index, start = busy.pop(connection)
+                try:
+                    reply = connection.recv()
+                except EOFError:
+                    worker.restart()
+                    reply = self._violated('crash'), perf_counter() - start, 'crash'
+                if isinstance(reply, BaseException):
+                    for other, _, _ in busy.values():
+                        other.restart()
+                    raise reply
+                outcome, cost, violation = reply
+                if violation is not None:
+                    self.violations[violation] += 1
+                if violation == 'memory':
+                    worker.restart()
+                runs[index] = outcome, cost
+                idle.append(worker)
+
+            if self.limits.seconds is not None:
+                now = perf_counter()
+                for connection, (worker, index, start) in list(busy.items()):
+                    if now - start >= self.limits.seconds + self.limits.grace:
+                        del busy[connection]
+                        worker.restart()
+                        self.violations['time'] += 1
+                        runs[index] = self._violated('time'), now - start
+                        idle.append(worker)
+        return runs
+
+    def _violated(self, budget: str) -> Outcome:
+        '''The outcome of a run whose worker had to be killed'''
+        with observation():
+            _violations[budget].trigger()
+            return tuple(c.was_triggered for c in self.conditions)
+
+    def close(self):
+        super().close()
+        for worker in self._workers:
+            worker.stop()
+        self._workers = []
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state['_workers'] = []
+        return state
+
+
+class _Worker:
+    def __init__(self, oracle: IsolatedOracle) -> None:
+        self.oracle = oracle
+        self.start()
+
+    def start(self):
+        context = multiprocessing.get_context('forkserver')
+        # only takes effect until the fork server has started
+        context.set_forkserver_preload([self.oracle.test_func.__module__, __name__])
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=_serve, args=(self.oracle, child), daemon=True)
+        self.process.start()
+        child.close()
+
+    def stop(self):
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+
+class _Interrupted(BaseException):
+    '''Raised into a run that is out of time; not an `Exception`, so that tests do not catch it'''
+
+    def __init__(self, mask: int, counts: dict[Condition, int]) -> None:
+        self.mask = mask
+        self.counts = counts
+
+
+_alarmed: TriggerState | None = None
+
+def _interrupt(signum, frame):
+    state = _alarmed
+    if state is not None:
+        raise _Interrupted(state.mask, dict(state.counts))
+
+def _serve(oracle: IsolatedOracle, connection: Connection):
+    limits = oracle.limits
+    if limits.recursion is not None:
+        sys.setrecursionlimit(_depth() + limits.recursion)
+    signal.signal(signal.SIGALRM, _interrupt)
+
+    while True:
+        try:
+            parse_tree = connection.recv()
+        except EOFError:
+            return
+        start = perf_counter()
+        try:
+            reply = _run_limited(oracle, parse_tree, limits)
+        except _Interrupted as interrupted:
+            # an alarm that went off just outside of the run must not kill the worker
+            with observation() as state:
+                state.mask, state.counts = interrupted.mask, interrupted.counts
+                timed_out.trigger()
+                reply = tuple(c.was_triggered for c in oracle.conditions), perf_counter() - start, 'time'
+        except Exception as e:
+            reply = e
+        try:
+            connection.send(reply)
+        except Exception as e:  # an exception that does not pickle
+            connection.send(RuntimeError(repr(e)))
+
+def _run_limited(oracle: IsolatedOracle, parse_tree: ParseTree, limits: Limits) -> tuple[Outcome, float, str | None]:
+    global _alarmed
+    if limits.memory is not None:
+        # relative to what the worker holds now, so that what earlier inputs left behind does not count
+        _limit_memory(_address_space() + limits.memory)
+    violation = None
+    start = perf_counter()
+    with observation() as state:
+        try:
+            if limits.seconds is not None:
+                _alarmed = state
+                signal.setitimer(signal.ITIMER_REAL, limits.seconds)
+            oracle.test_func(oracle.convert_input(DerivationTree.from_parse_tree(parse_tree)))
+        except _Interrupted as interrupted:
+            # `with condition:` blocks that were only left because of the interruption do not count
+            state.mask, state.counts = interrupted.mask, interrupted.counts
+            violation = 'time'
+        except RecursionError:
+            violation = 'recursion'
+        except MemoryError:
+            violation = 'memory'
+        finally:
+            # an alarm still going off here is caught in `_serve`
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            _alarmed = None
+
+        if violation is not None:
+            _violations[violation].trigger()
+        return tuple(c.was_triggered for c in oracle.conditions), perf_counter() - start, violation
+
+def _limit_memory(limit: int):
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    resource.setrlimit(resource.RLIMIT_AS, (limit if hard == resource.RLIM_INFINITY else min(limit, hard), hard))
+
+def _address_space() -> int:
+    '''Bytes of virtual memory this process uses, where /proc tells'''
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[0]) * resource.getpagesize()
+    except OSError:
+        return 0
+
+def _depth() -> int:
+    frame, depth = sys._getframe(), 0
+    while frame is not None:
+        frame, depth = frame.f_back, depth + 1
+    return depth
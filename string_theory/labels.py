@@ -0,0 +1,111 @@
+from typing import Sequence
+
+import warnings
+
+try:
+    import numpy as np
+except ImportError:  # only label matrices need numpy
+    np = None
+
+
+class LabelMatrix:
+    '''Labels of one corpus of samples, as boolean matrices.
+
+    `conditions` holds, for every sample (row) and test (column), whether running the test
+    on the sample triggered its condition. `membership` holds, for every sample and
+    precondition, whether the sample satisfies the precondition; `owners` maps each
+    precondition column to the test it was learned for. All statistics are computed for all
+    (test, precondition) pairs at once. Give `num_tests` so that an empty corpus still has
+    a column for every test; its base rates are then 0, and precision, recall and their
+    intervals NaN.
+
+    >>> empty = LabelMatrix([], [], [0, 1], num_tests=2)
+    >>> empty.base_rates().tolist(), empty.precision().tolist()
+    ([0.0, 0.0], [nan, nan])
+    >>> [interval.tolist() for interval in empty.bootstrap()]
+    [[[nan, nan], [nan, nan]], [[nan, nan], [nan, nan]]]
+    '''
+
+    def __init__(
+        self,
+        conditions: 'np.ndarray',
+        membership: 'np.ndarray',
+        owners: Sequence[int],
+        num_tests: int | None = None,
+    ) -> None:
+        if np is None:
+            raise ImportError('LabelMatrix needs numpy (pip install string_theory[stats])')
+
+        self.owners = np.asarray(owners, dtype=int)
+        self.conditions = np.asarray(conditions, dtype=bool)
+        if num_tests is not None:
+            self.conditions = self.conditions.reshape(len(self.conditions), num_tests)
+        self.membership = np.asarray(membership, dtype=bool).reshape(len(self.conditions), len(self.owners))
+
+    @property
+    def num_samples(self) -> int:
+        return self.conditions.shape[0]
+
+    @property
+    def truth(self) -> 'np.ndarray':
+        '''samples × preconditions: whether the sample triggered the precondition's condition'''
+        return self.conditions[:, self.owners]
+
+    def confusion(self) -> 'np.ndarray':
+        '''preconditions × 4: true positives, false positives, false negatives, true negatives,
+        where "positive" means satisfying the precondition and "true" triggering the condition'''
+        return _confusion(self.membership.astype(np.int64), self.truth.astype(np.int64), np.ones(self.num_samples, np.int64))
+
+    def base_rates(self) -> 'np.ndarray':
+        '''How often each test's condition is triggered by the whole corpus'''
+        return self.conditions.mean(axis=0) if self.num_samples else np.zeros(self.conditions.shape[1])
+
+    def precision(self) -> 'np.ndarray':
+        tp, fp, _, _ = self.confusion().T
+        return _divide(tp, tp + fp)
+
+    def recall(self) -> 'np.ndarray':
+        tp, _, fn, _ = self.confusion().T
+        return _divide(tp, tp + fn)
+
+    def bootstrap(
+        self,
+        resamples: int = 1000,
+        confidence: float = 0.95,
+        seed: int | None = None,
+    ) -> tuple['np.ndarray', 'np.ndarray']:
+        '''Percentile bootstrap intervals of precision and recall, each preconditions × 2.
+
+        Every resample is a vector of how often each sample is drawn, so the confusion
+        counts of all resamples come from a few matrix products.
+        '''
+        if self.num_samples == 0:
+            unknown = np.full((len(self.owners), 2), np.nan)
+            return unknown, unknown.copy()
+
+        rng = np.random.default_rng(seed)
+        weights = rng.multinomial(self.num_samples, np.full(self.num_samples, 1 / self.num_samples), size=resamples)
+        counts = _confusion(self.membership.astype(np.int64), self.truth.astype(np.int64), weights.T)
+        tp, fp, fn = counts[:, 0], counts[:, 1], counts[:, 2]
+
+        tail = (1 - confidence) / 2
+        quantiles = [tail, 1 - tail]
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)  # preconditions that some resamples never match
+            precision = np.nanquantile(_divide(tp, tp + fp), quantiles, axis=-1).T
+            recall = np.nanquantile(_divide(tp, tp + fn), quantiles, axis=-1).T
+        return precision, recall
+
+
+def _confusion(membership: 'np.ndarray', truth: 'np.ndarray', weights: 'np.ndarray') -> 'np.ndarray':
+    '''Weighted confusion counts; `weights` is samples, or samples × resamples'''
+    tp = (membership * truth).T @ weights
+    fp = (membership * (1 - truth)).T @ weights
+    fn = ((1 - membership) * truth).T @ weights
+    tn = ((1 - membership) * (1 - truth)).T @ weights
+    return np.stack([tp, fp, fn, tn], axis=1)
+
+
+def _divide(numerator: 'np.ndarray', denominator: 'np.ndarray') -> 'np.ndarray':
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(denominator > 0, numerator / denominator, np.nan)
@@ -0,0 +1,213 @@
+from isla.derivation_tree import DerivationTree
+from isla.type_defs import ParseTree
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Iterable, Sequence, Self
+from importlib import import_module
+from time import perf_counter
+
+import multiprocessing
+import sys
+
+from .condition import Condition, leaves, observation
+from .cache import LabelCache, test_identity
+
+
+Outcome = tuple[bool, ...]
+
+
+class Oracle:
+    '''Runs a test function and records, from that single run, which of the observed
+    conditions were triggered. Outcomes are remembered per input string in a label cache,
+    so every condition of the same test reuses the labelled samples.
+
+    With `jobs` > 1, batches are labelled by a pool of worker processes. Every worker
+    holds its own copy of the condition state, so concurrent runs never share trigger counts.
+    Workers are not forked, as inputs are often generated by a background thread meanwhile:
+    they import the system under test afresh. Of what the parent changed at runtime, only the
+    `configuration` is carried over, as of when the workers start; observing a batch after it
+    changed raises a RuntimeError.
+    '''
+
+    def __init__(
+        self,
+        test_func: Callable[[Any], Any],
+        conditions: Sequence[Condition],
+        convert_input: Callable[[DerivationTree], Any],
+        jobs: int | None = None,
+        cache: LabelCache | None = None,
+    ) -> None:
+        self.test_func = test_func
+        self.conditions = tuple(conditions)
+        self.convert_input = convert_input
+        self.jobs = jobs
+        self.cache = cache if cache is not None else LabelCache()
+        self.identity = test_identity(test_func, self.conditions)
+        self._executor: ProcessPoolExecutor | None = None
+        self._configuration: Configuration | None = None
+
+    def run(self, input: DerivationTree) -> Outcome:
+        with observation():
+            self.test_func(self.convert_input(input))
+            return tuple(c.was_triggered for c in self.conditions)
+
+    def timed_run(self, input: DerivationTree) -> tuple[Outcome, float]:
+        start = perf_counter()
+        outcome = self.run(input)
+        return outcome, perf_counter() - start
+
+    def observe(self, input: DerivationTree) -> Outcome:
+        return self.observe_all([input])[0]
+
+    def record(self, input: DerivationTree, outcome: Outcome):
+        '''Remember an outcome observed earlier, e.g. loaded from a sample cache'''
+        self.cache.put(self.identity, input.to_string(), outcome)
+
+    def observe_all(self, inputs: Iterable[DerivationTree]) -> list[Outcome]:
+        '''Observe a batch of inputs, in input order'''
+        outcomes: dict[str, Outcome] = {}
+        pending: dict[str, DerivationTree] = {}
+        keys = []
+        for input in inputs:
+            key = input.to_string()
+            keys.append(key)
+            if key in outcomes or key in pending:
+                continue
+            outcome = self.cache.get(self.identity, key)
+            if outcome is None:
+                pending[key] = input
+            else:
+                outcomes[key] = outcome
+
+        runs = self._runs(list(pending.values())) if pending else []
+        for key, (outcome, cost) in zip(pending.keys(), runs):
+            self.cache.put(self.identity, key, outcome, cost)
+            outcomes[key] = outcome
+        if pending:
+            self.cache.flush()
+
+        return [outcomes[key] for key in keys]
+
+    def _runs(self, inputs: list[DerivationTree]) -> Iterable[tuple[Outcome, float]]:
+        '''Outcomes and costs of running the test on inputs that are not cached yet'''
+        if self.jobs is None or self.jobs <= 1 or len(inputs) < 2:
+            return map(self.timed_run, inputs)
+        self.check_configuration()
+        # pickling a DerivationTree drops the k-path caches of the original tree,
+        # so the workers get plain parse trees instead
+        parse_trees = [input.to_parse_tree() for input in inputs]
+        chunk_size = max(1, len(parse_trees) // (self.jobs * 4))
+        return self.executor.map(_run_in_worker, parse_trees, chunksize=chunk_size)
+
+    def for_condition(self, condition: Condition) -> 'ConditionOracle':
+        return ConditionOracle(self, self.conditions.index(condition))
+
+    def configuration(self) -> 'Configuration':
+        '''Public globals and class attributes with plain values (None, numbers, strings and
+        conditions) of the modules that define the test and its conditions, such as a bug
+        injected with `Config.injected_bug = condition`'''
+        modules = {self.test_func.__module__}
+        for condition in self.conditions:
+            modules.update(leaf._module for leaf in leaves(condition) if getattr(leaf, '_module', None) is not None)
+        return _configuration(sorted(modules))
+
+    def check_configuration(self):
+        '''Raise if the configuration changed since the workers started'''
+        if self._configuration is None:
+            self._configuration = self.configuration()
+        elif not _same(self.configuration(), self._configuration):
+            raise RuntimeError(f'The system under test of {self.test_func.__qualname__} was reconfigured while '
+                               'its worker processes run; close the oracle first')
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload([self.test_func.__module__])
+            self._executor = ProcessPoolExecutor(self.jobs, mp_context=context, initializer=_init_worker,
+                                                 initargs=(self,))
+        return self._executor
+
+    def close(self):
+        self.cache.flush()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self._configuration = None
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['jobs'] = None
+        state['cache'] = LabelCache(max_size=0)
+        state['_executor'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._configuration is not None:
+            _configure(self._configuration)
+
+
+class ConditionOracle:
+    '''Labels inputs by whether running the test on them triggers one of the oracle's conditions'''
+
+    def __init__(self, oracle: Oracle, index: int) -> None:
+        self.oracle = oracle
+        self.index = index
+
+    def __call__(self, input: DerivationTree) -> bool:
+        return self.oracle.observe(input)[self.index]
+
+    def label(self, inputs: Iterable[DerivationTree]) -> list[bool]:
+        '''Label a batch of inputs, in input order'''
+        return [outcome[self.index] for outcome in self.oracle.observe_all(inputs)]
+
+
+Configuration = dict[tuple[str, str | None, str], Any]
+
+_plain = (type(None), bool, int, float, complex, str, bytes, Condition)
+
+def _configuration(modules: Iterable[str]) -> Configuration:
+    configuration = {}
+    for name in modules:
+        module = sys.modules.get(name)
+        if module is None:
+            continue
+        for attribute, value in vars(module).items():
+            if attribute.startswith('_'):
+                continue
+            if isinstance(value, _plain):
+                configuration[name, None, attribute] = value
+            elif isinstance(value, type) and value.__module__ == name and value.__qualname__ == attribute:
+                for class_attribute, class_value in vars(value).items():
+                    if not class_attribute.startswith('_') and isinstance(class_value, _plain):
+                        configuration[name, attribute, class_attribute] = class_value
+    return configuration
+
+def _same(configuration: Configuration, other: Configuration) -> bool:
+    return configuration.keys() == other.keys() and all(
+        value is other[key] or value == other[key] for key, value in configuration.items()
+    )
+
+def _configure(configuration: Configuration):
+    for (name, owner, attribute), value in configuration.items():
+        target = import_module(name)
+        if owner is not None:
+            target = getattr(target, owner)
+        setattr(target, attribute, value)
+
+
+_worker_oracle: Oracle | None = None
+
+def _init_worker(oracle: Oracle):
+    global _worker_oracle
+    _worker_oracle = oracle
+
+def _run_in_worker(parse_tree: ParseTree) -> tuple[Outcome, float]:
+    return _worker_oracle.timed_run(DerivationTree.from_parse_tree(parse_tree))
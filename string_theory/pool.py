@@ -0,0 +1,60 @@
+from isla.derivation_tree import DerivationTree
+
+from typing import Iterable, Iterator
+
+
+class SamplePool:
+    '''Derivation trees deduplicated by their string form, optionally labelled'''
+
+    def __init__(self, samples: Iterable[DerivationTree] = ()) -> None:
+        self.samples: dict[str, DerivationTree] = {}
+        self.labels: dict[str, bool] = {}
+        self.offered = 0
+        self.extend(samples)
+
+    def add(self, sample: DerivationTree, label: bool | None = None) -> bool:
+        '''Add a sample unless an equal one is already pooled; returns whether it was new'''
+        self.offered += 1
+        key = sample.to_string()
+        if key in self.samples:
+            return False
+
+        self.samples[key] = sample
+        if label is not None:
+            self.labels[key] = label
+        return True
+
+    def extend(self, samples: Iterable[DerivationTree]) -> list[DerivationTree]:
+        '''Add samples, returning the ones that were new'''
+        return [sample for sample in samples if self.add(sample)]
+
+    def label(self, sample: DerivationTree, label: bool):
+        self.labels[sample.to_string()] = label
+
+    def label_of(self, sample: DerivationTree) -> bool | None:
+        return self.labels.get(sample.to_string())
+
+    @property
+    def positive(self) -> list[DerivationTree]:
+        return [sample for key, sample in self.samples.items() if self.labels.get(key) is True]
+
+    @property
+    def negative(self) -> list[DerivationTree]:
+        return [sample for key, sample in self.samples.items() if self.labels.get(key) is False]
+
+    @property
+    def duplicates(self) -> int:
+        return self.offered - len(self.samples)
+
+    @property
+    def duplicate_rate(self) -> float:
+        return self.duplicates / self.offered if self.offered else 0.0
+
+    def __contains__(self, sample: DerivationTree) -> bool:
+        return sample.to_string() in self.samples
+
+    def __iter__(self) -> Iterator[DerivationTree]:
+        return iter(list(self.samples.values()))
+
+    def __len__(self) -> int:
+        return len(self.samples)
@@ -0,0 +1,195 @@
+from isla.type_defs import Grammar, ParseTree
+from isla.derivation_tree import DerivationTree
+from isla.language import Formula
+from isla.helpers import canonical
+from isla.evaluator import evaluate
+from grammar_graph import gg
+
+from bisect import bisect_right
+from functools import cached_property
+from typing import Iterator
+
+import random
+
+from .pool import SamplePool
+from .budget import Budget
+from .solvers import SolverFactory, default_factory
+from .utils import ShardedGenerator, SupervisedGenerator, generate_until_absolutely_cannot_anymore
+
+
+class GrammarSampler:
+    '''Random derivation trees of a grammar, for suites without a constraint.
+
+    On construction, every nonterminal gets the minimal depth of a tree derived from it and a
+    choice table of its alternatives, ordered by the depth they need. Below `max_depth`, any
+    alternative is picked uniformly; closer to it, only the alternatives that still fit are.
+    '''
+
+    def __init__(self, grammar: Grammar, max_depth: int = 16, seed: int | None = None) -> None:
+        self.grammar = grammar
+        self.max_depth = max_depth
+        self.random = random.Random(seed)
+
+        rules = {
+            nonterminal: [tuple(symbol for symbol in alternative if symbol != '') for alternative in alternatives]
+            for nonterminal, alternatives in canonical(grammar).items()
+        }
+        self.min_depths = _min_depths(rules)
+
+        # (alternatives sorted by the depth they need, those depths) per nonterminal
+        self.choices: dict[str, tuple[list[tuple[str, ...]], list[int]]] = {}
+        for nonterminal, alternatives in rules.items():
+            needed = sorted((self._needed_depth(alternative), alternative) for alternative in alternatives)
+            self.choices[nonterminal] = [alternative for _, alternative in needed], [depth for depth, _ in needed]
+
+    @cached_property
+    def graph(self) -> gg.GrammarGraph:
+        return gg.GrammarGraph.from_grammar(self.grammar)
+
+    def _needed_depth(self, alternative: tuple[str, ...]) -> int:
+        return 1 + max((self.min_depths[s] for s in alternative if s in self.min_depths), default=0)
+
+    def parse_tree(self, symbol: str = '<start>', depth: int = 0) -> ParseTree:
+        alternatives, needed = self.choices[symbol]
+        fitting = bisect_right(needed, self.max_depth - depth)
+        alternative = alternatives[self.random.randrange(fitting) if fitting else 0]
+
+        if not alternative:
+            return symbol, [('', [])]
+        return symbol, [
+            self.parse_tree(child, depth + 1) if child in self.choices else (child, [])
+            for child in alternative
+        ]
+
+    def sample(self) -> DerivationTree:
+        return DerivationTree.from_parse_tree(self.parse_tree())
+
+    def samples(self, count: int) -> list[DerivationTree]:
+        return [self.sample() for _ in range(count)]
+
+    def distinct(self, pool: SamplePool | None = None, patience: int = 1000) -> Iterator[DerivationTree]:
+        '''Yield distinct samples until `patience` samples in a row were duplicates'''
+        if pool is None:
+            pool = SamplePool()
+        misses = 0
+        while misses < patience:
+            sample = self.sample()
+            if pool.add(sample):
+                misses = 0
+                yield sample
+            else:
+                misses += 1
+
+
+class HybridGenerator:
+    '''Distinct inputs that satisfy `formula`, generated as cheaply as the formula allows.
+
+    Without a formula, inputs come straight from the grammar sampler ("sampling"). Otherwise,
+    grammar samples are checked against the formula and the passing ones kept ("rejection"),
+    as long as at least `threshold` of them pass; the rate is first judged after `window`
+    candidates. Below that, generation falls back to an ISLa solver ("solver"): in this
+    process, in `shards` processes, or in a child process killed after a `deadline` without
+    output. `mode` tells which one is in use. Generation stops once the `budget` runs out,
+    also while candidates are being rejected.
+    '''
+
+    def __init__(
+        self,
+        sampler: GrammarSampler,
+        formula: Formula | None,
+        solvers: SolverFactory = default_factory,
+        threshold: float = 0.05,
+        window: int = 50,
+        timeouts: int | None = 10,
+        shards: int | None = None,
+        deadline: float | None = None,
+        budget: Budget | None = None,
+    ) -> None:
+        self.sampler = sampler
+        self.formula = formula
+        self.solvers = solvers
+        self.threshold = threshold
+        self.window = window
+        self.timeouts = timeouts
+        self.shards = shards
+        self.deadline = deadline
+        self.budget = budget or Budget()
+
+        self.mode = 'sampling' if formula is None else 'rejection'
+        self.accepted = 0
+        self.rejected = 0
+        self.pool = SamplePool()
+        self._processes: ShardedGenerator | SupervisedGenerator | None = None
+
+    @property
+    def acceptance_rate(self) -> float:
+        tried = self.accepted + self.rejected
+        return self.accepted / tried if tried else 0.0
+
+    def accepts(self, sample: DerivationTree) -> bool:
+        return evaluate(self.formula, sample, self.sampler.grammar, graph=self.sampler.graph).is_true()
+
+    def __iter__(self) -> Iterator[DerivationTree]:
+        if self.formula is None:
+            for sample in self.sampler.distinct(self.pool):
+                if self.budget.should_stop():
+                    return
+                yield sample
+            return
+
+        if self.mode == 'rejection':
+            for candidate in self.sampler.distinct():
+                if self.budget.should_stop():
+                    return
+                if candidate in self.pool:
+                    continue
+                if self.accepts(candidate):
+                    self.accepted += 1
+                    self.pool.add(candidate)
+                    yield candidate
+                else:
+                    self.rejected += 1
+
+                if self.accepted + self.rejected >= self.window and self.acceptance_rate < self.threshold:
+                    break
+            else:
+                return
+
+        self.mode = 'solver'
+        if self.shards is not None and self.shards > 1:
+            with ShardedGenerator(self.sampler.grammar, self.formula, self.shards, self.timeouts, pool=self.pool) as sharded:
+                self._processes = sharded
+                yield from sharded
+            return
+        if self.deadline is not None:
+            with SupervisedGenerator(self.sampler.grammar, self.formula, self.deadline, self.timeouts,
+                                     pool=self.pool) as supervised:
+                self._processes = supervised
+                yield from supervised
+            return
+
+        solver = self.solvers.solver(self.sampler.grammar, self.formula)
+        for sample in generate_until_absolutely_cannot_anymore(solver, timeouts=self.timeouts, pool=self.pool):
+            if self.budget.should_stop():
+                return
+            yield sample
+
+    def close(self):
+        '''Stop the solver processes, if any; safe while another thread iterates the generator'''
+        if self._processes is not None:
+            self._processes.close()
+
+
+def _min_depths(rules: dict[str, list[tuple[str, ...]]]) -> dict[str, int]:
+    '''The depth of the shallowest tree derivable from each nonterminal'''
+    depths = {nonterminal: float('inf') for nonterminal in rules}
+    changed = True
+    while changed:
+        changed = False
+        for nonterminal, alternatives in rules.items():
+            for alternative in alternatives:
+                depth = 1 + max((depths[s] for s in alternative if s in depths), default=0)
+                if depth < depths[nonterminal]:
+                    depths[nonterminal] = depth
+                    changed = True
+    return depths
@@ -0,0 +1,158 @@
+from isla.derivation_tree import DerivationTree
+
+from dataclasses import dataclass
+from collections import Counter
+
+import random
+
+
+@dataclass
+class RoundStats:
+    seeds: int
+    new_positive: int
+    new_negative: int
+    duplicates: int
+    seconds: float
+
+    @property
+    def mutants(self) -> int:
+        return self.new_positive + self.new_negative + self.duplicates
+
+    @property
+    def positive_yield(self) -> float:
+        return self.new_positive / self.mutants if self.mutants else 0.0
+
+
+class PowerSchedule:
+    '''Decides how much mutation effort each seed gets, in the manner of AFL's power schedules.
+
+    Every labelled input contributes its outcome: whether each observed condition was
+    triggered. How often a condition triggers is thus counted across inputs, not within a run;
+    the per-run `Condition.count` is not part of the outcomes that oracles cache and share.
+    A seed gets more energy the rarer its outcome is, so seeds near rarely triggered
+    conditions (or near rare non-triggering behaviour) are mutated more often, and seeds whose
+    mutants flipped an outcome sit on a boundary and get a bonus. Seeds whose mutants keep
+    coming out as duplicates are saturated and get less.
+    '''
+
+    def __init__(self, max_energy: int = 16) -> None:
+        self.max_energy = max_energy
+        self.outcomes: dict[str, tuple[bool, ...]] = {}
+        self.frequencies: Counter[tuple[int, bool]] = Counter()
+        self.mutations: Counter[str] = Counter()
+        self.flips: Counter[str] = Counter()
+        self.duplicates: Counter[str] = Counter()
+
+    def observe(self, sample: DerivationTree, outcome: tuple[bool, ...], parent: DerivationTree | None = None):
+        key = sample.to_string()
+        if key not in self.outcomes:
+            self.outcomes[key] = outcome
+            self.frequencies.update(enumerate(outcome))
+
+        if parent is not None:
+            parent_key = parent.to_string()
+            self.mutations[parent_key] += 1
+            if self.outcomes.get(parent_key, outcome) != outcome:
+                self.flips[parent_key] += 1
+
+    def duplicate(self, parent: DerivationTree):
+        '''Record that mutating `parent` produced nothing new'''
+        parent_key = parent.to_string()
+        self.mutations[parent_key] += 1
+        self.duplicates[parent_key] += 1
+
+    def energy(self, sample: DerivationTree) -> int:
+        key = sample.to_string()
+        outcome = self.outcomes.get(key)
+        if outcome is None:
+            return 1
+
+        rarest = min((self.frequencies[feature] for feature in enumerate(outcome)), default=0)
+        rarity = len(self.outcomes) / rarest if rarest else 1.0
+        mutations = self.mutations[key]
+        boundary = 1 + self.flips[key] / mutations if mutations else 1.0
+        saturation = 1 + self.duplicates[key]
+        return max(1, min(self.max_energy, round(rarity * boundary / saturation)))
+
+
+class MutationScheduler:
+    '''Bounds the mutation phase of fuzzing.
+
+    Seeds are drawn from a fixed-size reservoir sample of everything labelled so far, so the
+    working set never grows with the number of samples. Every round mutates at most
+    `max_per_round` seeds, and at most `max_total` mutants are made overall. Mutation stops
+    early once `patience` consecutive rounds have a positive yield below `min_yield`.
+
+    With a `power` schedule, seeds are drawn in proportion to their energy, so promising
+    seeds may be mutated several times in one round.
+    '''
+
+    def __init__(
+        self,
+        max_rounds: int = 20,
+        max_per_round: int = 50,
+        max_total: int = 500,
+        reservoir_size: int = 200,
+        min_yield: float = 0.02,
+        patience: int = 3,
+        seed: int | None = None,
+        power: PowerSchedule | None = None,
+    ) -> None:
+        self.max_rounds = max_rounds
+        self.max_per_round = max_per_round
+        self.max_total = max_total
+        self.reservoir_size = reservoir_size
+        self.min_yield = min_yield
+        self.patience = patience
+        self.power = power
+
+        self.random = random.Random(seed)
+        self.reservoir: list[DerivationTree] = []
+        self.offered = 0
+        self.rounds: list[RoundStats] = []
+
+    def offer(self, sample: DerivationTree, outcome: tuple[bool, ...] | None = None, parent: DerivationTree | None = None):
+        '''Consider a labelled sample as a future seed (reservoir sampling)'''
+        if self.power is not None and outcome is not None:
+            self.power.observe(sample, outcome, parent)
+
+        self.offered += 1
+        if len(self.reservoir) < self.reservoir_size:
+            self.reservoir.append(sample)
+            return
+
+        index = self.random.randrange(self.offered)
+        if index < self.reservoir_size:
+            self.reservoir[index] = sample
+
+    @property
+    def total_mutants(self) -> int:
+        return sum(r.mutants for r in self.rounds)
+
+    @property
+    def total_seconds(self) -> float:
+        return sum(r.seconds for r in self.rounds)
+
+    def should_continue(self) -> bool:
+        if len(self.rounds) >= self.max_rounds or self.total_mutants >= self.max_total:
+            return False
+        if len(self.reservoir) == 0:
+            return False
+
+        recent = self.rounds[-self.patience:]
+        return len(recent) < self.patience or any(r.positive_yield >= self.min_yield for r in recent)
+
+    def next_seeds(self) -> list[DerivationTree]:
+        size = min(self.max_per_round, self.max_total - self.total_mutants, len(self.reservoir))
+        if self.power is None:
+            return self.random.sample(self.reservoir, size)
+
+        energies = [self.power.energy(seed) for seed in self.reservoir]
+        return self.random.choices(self.reservoir, weights=energies, k=size)
+
+    def record(self, stats: RoundStats):
+        self.rounds.append(stats)
+
+    def summary(self) -> str:
+        rounds = ', '.join(f'{r.new_positive}+/{r.new_negative}-/{r.duplicates}d in {r.seconds:.1f}s' for r in self.rounds)
+        return f'{len(self.rounds)} mutation rounds [{rounds}]'
@@ -0,0 +1,113 @@
+from isla.type_defs import Grammar
+from isla.language import Formula, ISLaUnparser
+from isla.solver import ISLaSolver, GrammarBasedBlackboxCostComputer
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from time import perf_counter
+
+import copy
+import json
+
+
+@dataclass
+class _Prototype:
+    solver: ISLaSolver
+    queue: list
+    tree_hashes: set[int]
+    state_hashes: set[int]
+    construction_seconds: float
+
+
+class SolverFactory:
+    '''Hands out fresh ISLa solvers without rebuilding them from scratch.
+
+    The first solver for a (grammar, formula, options) combination is constructed normally
+    and kept as a prototype, including its grammar graph, canonical grammar and preprocessed
+    initial queue. Later requests get a shallow copy of the prototype with the search state
+    reset. The regular expressions that solvers derive for nonterminals are shared by all
+    solvers of the same grammar. Only the `max_prototypes` most recently used prototypes are
+    kept, since every precondition that needs a solver adds one.
+    '''
+
+    def __init__(self, max_prototypes: int = 32) -> None:
+        self.max_prototypes = max_prototypes
+        self.prototypes: OrderedDict[str, _Prototype] = OrderedDict()
+        self.regex_caches: dict[str, dict] = {}
+
+        self.built = 0
+        self.reused = 0
+        self.construction_seconds = 0.0
+        self.saved_seconds = 0.0
+
+    def solver(self, grammar: Grammar, formula: Formula | None = None, **options) -> ISLaSolver:
+        grammar_key = json.dumps(grammar, sort_keys=True)
+        formula_key = ISLaUnparser(formula).unparse() if formula is not None else ''
+        key = '\0'.join((grammar_key, formula_key, repr(sorted(options.items()))))
+
+        prototype = self.prototypes.get(key)
+        if prototype is None:
+            start = perf_counter()
+            solver = ISLaSolver(grammar, formula, **options)
+            solver.regex_cache = self.regex_caches.setdefault(grammar_key, solver.regex_cache)
+            elapsed = perf_counter() - start
+
+            prototype = self.prototypes[key] = _Prototype(
+                solver,
+                list(solver.queue),
+                set(solver.tree_hashes_in_queue),
+                set(solver.state_hashes_in_queue),
+                elapsed,
+            )
+            while len(self.prototypes) > self.max_prototypes:
+                self.prototypes.popitem(last=False)
+            self.built += 1
+            self.construction_seconds += elapsed
+            return self._reset_copy(prototype)
+
+        self.prototypes.move_to_end(key)
+        start = perf_counter()
+        solver = self._reset_copy(prototype)
+        self.reused += 1
+        self.saved_seconds += prototype.construction_seconds - (perf_counter() - start)
+        return solver
+
+    def __getstate__(self):
+        # prototypes hold unpicklable solver state; every process builds its own
+        return {'max_prototypes': self.max_prototypes}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def renew(self, solver: ISLaSolver) -> ISLaSolver:
+        '''A fresh solver for the grammar and formula of `solver`'''
+        return self.solver(solver.grammar, solver.formula)
+
+    def _reset_copy(self, prototype: _Prototype) -> ISLaSolver:
+        solver = copy.copy(prototype.solver)
+
+        solver.queue = list(prototype.queue)
+        solver.tree_hashes_in_queue = set(prototype.tree_hashes)
+        solver.state_hashes_in_queue = set(prototype.state_hashes)
+        solver.solutions = []
+        solver.seen_coverages = set()
+        solver.current_level = 0
+        solver.step_cnt = 0
+        solver.last_cost_recomputation = 0
+        solver.start_time = None
+        solver.timeout_seconds = prototype.solver.timeout_seconds
+
+        solver.fuzzer = copy.copy(prototype.solver.fuzzer)
+        solver.fuzzer.reset_coverage()
+        solver.cost_computer = copy.copy(prototype.solver.cost_computer)
+        if isinstance(solver.cost_computer, GrammarBasedBlackboxCostComputer):
+            solver.cost_computer.covered_k_paths = set()
+            solver.cost_computer.rounds_with_no_new_coverage = 0
+
+        solver.state_tree = {}
+        solver.costs = {}
+        solver.current_state = None
+        return solver
+
+
+default_factory = SolverFactory()
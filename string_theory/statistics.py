@@ -0,0 +1,21 @@
+from statistics import NormalDist
+
+import math
+
+
+def wilson_interval(successes: int, trials: int, confidence: float = 0.95) -> tuple[float, float]:
+    '''Wilson score interval for a binomial proportion'''
+    if trials == 0:
+        return 0.0, 1.0
+
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    p = successes / trials
+    denominator = 1 + z * z / trials
+    centre = (p + z * z / (2 * trials)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / trials + z * z / (4 * trials * trials)) / denominator
+    return max(0.0, centre - margin), min(1.0, centre + margin)
+
+
+def interval_width(successes: int, trials: int, confidence: float = 0.95) -> float:
+    lower, upper = wilson_interval(successes, trials, confidence)
+    return upper - lower
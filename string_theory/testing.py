@@ -4,17 +4,31 @@ from isla.language import Formula, parse_bnf, DerivationTree
 from isla.fuzzer import GrammarCoverageFuzzer
 from isla.language import Formula, ISLaUnparser
 
-from itertools import chain, islice
+from itertools import islice, repeat, takewhile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack, closing, nullcontext
+from time import perf_counter
 
 from islearn.learner import InvariantLearner
-from isla.solver import ISLaSolver
+from isla.evaluator import evaluate
 
 from typing import Any, Callable, Iterable
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 
 from .condition import Condition
+from .oracle import Oracle, ConditionOracle, Outcome
+from .isolation import IsolatedOracle, Limits
+from .cache import SampleCache, LabelCache, fingerprint
+from .pool import SamplePool
+from .solvers import SolverFactory, default_factory
+from .budget import Budget
+from .scheduler import MutationScheduler, PowerSchedule, RoundStats
+from .statistics import wilson_interval, interval_width
+from .coverage import CoverageGuide, CoverageTracker
+from .sampler import GrammarSampler, HybridGenerator
+from .labels import LabelMatrix
 
-from string_theory.utils import generate_until_absolutely_cannot_anymore
+from string_theory.utils import Prefetcher, ShardedGenerator, SupervisedGenerator, SupervisedMutator, batched, solutions
 
 
 @dataclass(frozen=True)
@@ -27,6 +41,59 @@ class ObservableTest:
     @property
     def name(self):
         return self.test_func.__name__
+
+
+@dataclass(frozen=True)
+class AccuracyResult:
+    '''How often the observed condition was triggered by inputs from the grammar and suite
+    formula alone (raw), and by inputs that also satisfy the learned precondition'''
+    test: ObservableTest
+    precondition: Formula
+    raw_passing: int = 0
+    raw_failing: int = 0
+    res_passing: int = 0
+    res_failing: int = 0
+    measured: bool = True
+    budget_exhausted: bool = False
+    confidence: float = 0.95
+    generation_mode: str | None = None
+    recall: float | None = None
+    equivalent_to: Formula | None = None
+
+    @property
+    def raw_accuracy(self) -> float:
+        return _ratio(self.raw_passing, self.raw_failing)
+
+    @property
+    def res_accuracy(self) -> float:
+        return _ratio(self.res_passing, self.res_failing)
+
+    @property
+    def raw_samples(self) -> int:
+        return self.raw_passing + self.raw_failing
+
+    @property
+    def res_samples(self) -> int:
+        return self.res_passing + self.res_failing
+
+    @property
+    def raw_interval(self) -> tuple[float, float]:
+        return wilson_interval(self.raw_passing, self.raw_samples, self.confidence)
+
+    @property
+    def res_interval(self) -> tuple[float, float]:
+        return wilson_interval(self.res_passing, self.res_samples, self.confidence)
+
+
+def _ratio(passing: int, failing: int) -> float:
+    total = passing + failing
+    return passing / total if total else 0.0
+
+
+def _counts(outcomes: list[Outcome], width: int) -> list[tuple[int, int]]:
+    '''Passing and failing counts for each of the `width` conditions of the outcomes'''
+    passing = [sum(outcome[position] for outcome in outcomes) for position in range(width)]
+    return [(p, len(outcomes) - p) for p in passing]
     
 
 class ObservableTestSuite:
@@ -37,18 +104,83 @@ class ObservableTestSuite:
         formula: Formula | None = None,
         input_adapter: Callable[[DerivationTree], Any] | None = None,
         target_num_samples: int = 200,
+        oracle_jobs: int | None = None,
+        sample_cache: SampleCache | None = None,
+        label_cache: LabelCache | None = None,
+        solver_factory: SolverFactory | None = None,
+        mutation_options: dict | None = None,
+        greybox: bool = False,
+        rejection_threshold: float = 0.05,
+        representatives_per_class: int | None = 1,
+        prefetch: int | None = None,
+        generation_shards: int | None = None,
+        solver_deadline: float | None = None,
+        input_limits: Limits | None = None,
+        coverage_roots: Iterable[str] | None = None,
     ) -> None:
+        if greybox and input_limits is not None:
+            # coverage is tracked in this process, where no input limit applies
+            raise ValueError('greybox fuzzing cannot run tests within input_limits')
+
         self.tests: list[ObservableTest] = []
         self.grammar = grammar
         self.formula = formula
         self.target_num_samples = target_num_samples
+        self.oracle_jobs = oracle_jobs
+        self.sample_cache = sample_cache
+        self.label_cache = label_cache if label_cache is not None else LabelCache()
+        self.solvers = solver_factory if solver_factory is not None else default_factory
+        self.mutation_options = mutation_options or {}
+        self.greybox = greybox
+        self.rejection_threshold = rejection_threshold
+        self.representatives_per_class = representatives_per_class
+        self.prefetch = prefetch
+        self.generation_shards = generation_shards
+        self.solver_deadline = solver_deadline
+        self.input_limits = input_limits
+        self.coverage_roots = coverage_roots
+        self._sampler: GrammarSampler | None = None
 
         self.results = []
+        self.budget_exhausted: set[int] = set()
+        self.equivalents: dict[int, dict[Formula, Formula]] = {}
         self.is_verbose = False
     
         if input_adapter:
             self.convert_input = input_adapter
     
+    def __getstate__(self):
+        # workers build their own solvers and sampler, and open their own label cache
+        state = self.__dict__.copy()
+        state['results'] = []
+        state['budget_exhausted'] = set()
+        state['equivalents'] = {}
+        state['_sampler'] = None
+        if self.solvers is default_factory:
+            state['solvers'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.solvers is None:
+            self.solvers = default_factory
+
+    @property
+    def sampler(self) -> GrammarSampler:
+        '''Samples the grammar directly, in place of a solver, when there is no constraint'''
+        if self._sampler is None:
+            self._sampler = GrammarSampler(self.grammar)
+        return self._sampler
+
+    def stream(self, inputs: Iterable[DerivationTree], stop: Callable[[], Any] | None = None) -> Prefetcher | nullcontext:
+        '''A context that generates `inputs` ahead of their use, in the background, if the suite
+        prefetches. On exit, `stop` is called before waiting for the background thread, to wake it
+        if it waits for processes; an in-process solver is waited for until its current `solve()`
+        returns, as the solver is used again afterwards.'''
+        if self.prefetch is None:
+            return nullcontext(inputs)
+        return Prefetcher(inputs, self.prefetch, stop)
+
     def verbose(self):
         self.is_verbose = True
         return self
@@ -63,6 +195,32 @@ class ObservableTestSuite:
     
     def convert_input(self, tree: DerivationTree):
         return tree.to_string()
+
+    def oracle(self, tests: list[ObservableTest]) -> Oracle:
+        '''Oracle observing the conditions of tests that share one test function'''
+        if self.input_limits is not None:
+            return IsolatedOracle(
+                tests[0].test_func,
+                [test.condition for test in tests],
+                self.convert_input,
+                self.input_limits,
+                self.oracle_jobs,
+                self.label_cache,
+            )
+        return Oracle(
+            tests[0].test_func,
+            [test.condition for test in tests],
+            self.convert_input,
+            self.oracle_jobs,
+            self.label_cache,
+        )
+
+    def groups(self) -> list[list[int]]:
+        '''Indices of `self.tests`, grouped by test function'''
+        groups: dict[Callable, list[int]] = {}
+        for index, test in enumerate(self.tests):
+            groups.setdefault(test.test_func, []).append(index)
+        return list(groups.values())
     
     def observe(
         self,
@@ -77,46 +235,174 @@ class ObservableTestSuite:
         
         return decorate
 
-    def learn_preconditions(self, print_progress: bool = True, max_learner_retries: int = 5):
+    def learn_preconditions(
+        self,
+        print_progress: bool = True,
+        max_learner_retries: int = 5,
+        jobs: int | None = None,
+        budget_seconds: float | None = None,
+        test_budget_seconds: float | None = None,
+    ):
+        '''Learn preconditions for every observed test. Tests that share a test function
+        are learned together, from samples labelled with a single run per input.
+        With `jobs` > 1, each such group is learned in its own worker process;
+        results keep the order of `self.tests`.
+
+        Learning stops cleanly once the suite's or a test's time budget runs out; indices
+        of tests whose results are partial are kept in `self.budget_exhausted`'''
         self.results = []  # reset results
+        budget = Budget(budget_seconds)
+
+        groups = self.groups()
+        if jobs is None or jobs <= 1:
+            learned = (
+                self.learn_group(
+                    [self.tests[i] for i in group],
+                    print_progress,
+                    max_learner_retries,
+                    budget,
+                    test_budget_seconds,
+                )
+                for group in groups
+            )
+            return self._collect_results(groups, learned)
+
+        # test functions and conditions are shipped to the workers by their
+        # module-qualified names, so they have to be defined at the module level
+        with ProcessPoolExecutor(jobs, initializer=_init_worker, initargs=(self,)) as executor:
+            learned = executor.map(
+                _learn_in_worker,
+                groups,
+                repeat(print_progress),
+                repeat(max_learner_retries),
+                repeat(budget),
+                repeat(test_budget_seconds),
+            )
+            return self._collect_results(groups, learned)
+
+    def _collect_results(self, groups: list[list[int]], learned: Iterable[list[tuple[list[Formula], bool, dict[Formula, Formula]]]]):
+        by_index = {}
+        for group, results in zip(groups, learned):
+            by_index.update(zip(group, results))
+
+        self.results = [(test, by_index[i][0]) for i, test in enumerate(self.tests)]
+        self.budget_exhausted = {i for i, (_, exhausted, _) in by_index.items() if exhausted}
+        self.equivalents = {i: equivalents for i, (_, _, equivalents) in by_index.items() if equivalents}
+        return self.results
 
-        for test in self.tests:
-            if print_progress:
-                self.debug(f'\n\nLearning preconditions for {test.name} ({test.condition.description})')
-            def validate_condition(input: DerivationTree) -> bool:
-                test.condition.reset()
-                test.test_func(self.convert_input(input))
-                return test.condition.was_triggered
-
-            result = []
-            tries = 0
-            positive, negative = [], []
-            while len(result) == 0 and tries < max_learner_retries:
-                np, nn = self.fuzz_samples(validate_condition)
-                positive.extend(np)
-                negative.extend(nn)
-                result: dict[Formula, tuple[float, float]] = InvariantLearner(
-                    grammar=self.grammar,
-                    prop=validate_condition,
-                    positive_examples=positive,
-                    negative_examples=negative,
-                    **(test.learner_options or {}),
-                ).learn_invariants()
-                tries += 1
-
-            if tries > 1:
-                self.debug(f'tried learning invariants {tries} times.\n')
-
-            self.results.append((test, list(result.keys())))
-
-            if len(result) == 0:
-                self.debug('No preconditions found')
-            else:
-                self.debug("\n".join(map(
-                    lambda p: f"{p[1]}: " + ISLaUnparser(p[0]).unparse(),
-                    {f: p for f, p in result.items() if p[0] > .0}.items())))
+    def learn_group(
+        self,
+        tests: list[ObservableTest],
+        print_progress: bool = True,
+        max_learner_retries: int = 5,
+        budget: Budget | None = None,
+        test_budget_seconds: float | None = None,
+    ) -> list[tuple[list[Formula], bool, dict[Formula, Formula]]]:
+        '''Preconditions learned for each of the tests, whether their budget cut learning short,
+        and which preconditions are equivalent to another one on the labelled samples'''
+        budget = budget or Budget()
+        samples = SamplePool()  # labelled once, shared by all conditions of the group
+        with self.oracle(tests) as oracle:
+            if self.sample_cache is not None:
+                key = fingerprint(self.grammar, self.formula, oracle.test_func, oracle.conditions)
+                for sample, outcome in self.sample_cache.load(key):
+                    oracle.record(sample, outcome)
+                    samples.add(sample)
+                if samples:
+                    self.debug(f'Loaded {len(samples)} cached samples')
+
+            results = []
+            for test in tests:
+                validate_condition = oracle.for_condition(test.condition)
+                test_budget = budget.child(test_budget_seconds)
+                learned = self.learn_test(
+                    test, validate_condition, samples, print_progress, max_learner_retries, test_budget
+                )
+                equivalents = {}
+                if self.representatives_per_class is not None and len(learned) > 1:
+                    equivalents = self.equivalent_preconditions(learned, list(samples), self.representatives_per_class)
+                    if equivalents:
+                        self.debug(f'{len(equivalents)} of {len(learned)} preconditions are equivalent to others')
+                results.append((list(learned), test_budget.interrupted, equivalents))
+
+            if isinstance(oracle, IsolatedOracle) and oracle.violations:
+                self.debug(f'Inputs over budget: {dict(oracle.violations)}')
+            return results
+
+    def learn_test(
+        self,
+        test: ObservableTest,
+        validate_condition: ConditionOracle,
+        samples: SamplePool,
+        print_progress: bool = True,
+        max_learner_retries: int = 5,
+        budget: Budget | None = None,
+    ):
+        budget = budget or Budget()
+        if print_progress:
+            self.debug(f'\n\nLearning preconditions for {test.name} ({test.condition.description})')
+        result = {}
+        tries = 0
+        positive, negative = self.split_on_passing(samples, validate_condition)
+        initial_target = self.target_num_samples // 5
+        while len(result) == 0 and tries < max_learner_retries and not budget.should_stop():
+            if tries > 0 or len(positive) <= initial_target or len(negative) <= initial_target:
+                np, nn = self.fuzz_samples(validate_condition, budget=budget)
+                positive.extend(samples.extend(np))
+                negative.extend(samples.extend(nn))
+                # before learning, so that a crashing learner does not lose the samples
+                self.store_samples(validate_condition.oracle, samples)
+            if budget.should_stop():
+                break
+            result: dict[Formula, tuple[float, float]] = InvariantLearner(
+                grammar=self.grammar,
+                prop=validate_condition,
+                positive_examples=positive,
+                negative_examples=negative,
+                **(test.learner_options or {}),
+            ).learn_invariants()
+            tries += 1
+
+        if tries > 1:
+            self.debug(f'tried learning invariants {tries} times.\n')
+
+        if budget.interrupted:
+            self.debug('Time budget exhausted')
+
+        if len(result) == 0:
+            self.debug('No preconditions found')
+        else:
+            self.debug("\n".join(map(
+                lambda p: f"{p[1]}: " + ISLaUnparser(p[0]).unparse(),
+                {f: p for f, p in result.items() if p[0] > .0}.items())))
 
-        return self.results
+        return result
+
+    def store_samples(self, oracle: Oracle, samples: SamplePool):
+        '''Persist the labelled samples of the oracle's tests, so that a rerun can skip straight to learning'''
+        if self.sample_cache is not None:
+            key = fingerprint(self.grammar, self.formula, oracle.test_func, oracle.conditions)
+            self.sample_cache.store(key, zip(samples, oracle.observe_all(samples)))
+
+    def equivalent_preconditions(
+        self,
+        learned: dict[Formula, tuple[float, float]],
+        samples: list[DerivationTree],
+        per_class: int = 1,
+    ) -> dict[Formula, Formula]:
+        '''Group the learned preconditions by whether each sample satisfies them. In every group,
+        the `per_class` preconditions with the best learner (precision, recall) stand for the
+        group; the others are mapped to the best one.'''
+        classes: dict[tuple[bool, ...], list[Formula]] = {}
+        for formula in learned:
+            classes.setdefault(tuple(self.matches(formula, samples)), []).append(formula)
+
+        equivalents = {}
+        for members in classes.values():
+            members.sort(key=lambda formula: learned[formula], reverse=True)
+            for formula in members[per_class:]:
+                equivalents[formula] = members[0]
+        return equivalents
 
     def preconditions_for(self, test):
         for test, preconditions in self.results:
@@ -128,9 +414,16 @@ class ObservableTestSuite:
         self.pattern_catalogue = catalogue
         return self
 
-    def fuzz_samples(self, property: Callable[[DerivationTree], bool], num_tries: int = 100):
+    def fuzz_samples(
+        self,
+        oracle: ConditionOracle,
+        num_tries: int = 100,
+        budget: Budget | None = None,
+        scheduler: MutationScheduler | None = None,
+    ):
+        budget = budget or Budget()
         self.debug('Fuzzing samples', end='... ')
-        solver = ISLaSolver(
+        solver = self.solvers.solver(
             grammar=self.grammar,
             formula=self.formula,
             # enable_optimized_z3_queries=False,
@@ -138,103 +431,395 @@ class ObservableTestSuite:
             # max_number_smt_instantiations=50,
             # max_number_tree_insertion_results=20,
         )
-
-        positive_examples = []
-        negative_examples = []
+        solver.timeout_seconds = budget.timeout(solver.timeout_seconds)
+
+        pool = SamplePool()
+        if self.formula is None:
+            source = self.sampler.distinct(patience=num_tries)
+        elif self.generation_shards is not None and self.generation_shards > 1:
+            source = ShardedGenerator(self.grammar, self.formula, self.generation_shards, solver.timeout_seconds)
+        elif self.solver_deadline is not None:
+            source = SupervisedGenerator(self.grammar, self.formula, self.solver_deadline, solver.timeout_seconds)
+        else:
+            source = solutions(solver)
+        guide = None
+        if self.greybox:
+            # by default, the code next to the test function and to its conditions
+            tracker = CoverageTracker(self.coverage_roots) if self.coverage_roots is not None else None
+            guide = CoverageGuide(oracle, tracker)
+        label = guide.label if guide is not None else oracle.label
 
         initial_target = self.target_num_samples // 5
+        batch_size = max(1, initial_target)
 
-        for _ in range(num_tries):
-            if len(positive_examples) > initial_target and len(negative_examples) > initial_target:
-                break
+        tried = 0
+        stop = source.close if isinstance(source, (ShardedGenerator, SupervisedGenerator)) else None
+        # coverage tracking would see the lines a background producer runs, so greybox labelling does not prefetch
+        stream = nullcontext(islice(source, num_tries)) if guide is not None else self.stream(islice(source, num_tries), stop)
+        with closing(source), stream as samples:
+            while tried < num_tries and not budget.should_stop():
+                if len(pool.positive) > initial_target and len(pool.negative) > initial_target:
+                    break
+
+                batch = []
+                try:
+                    while len(batch) < batch_size and tried < num_tries and not budget.should_stop():
+                        tried += 1
+                        sample = next(samples)
+                        if pool.add(sample):
+                            batch.append(sample)
+                except StopIteration:
+                    tried = num_tries
+
+                for sample, is_positive in zip(batch, label(batch)):
+                    pool.label(sample, is_positive)
+        if isinstance(source, (ShardedGenerator, SupervisedGenerator)):
+            self.debug(source.summary(), end='... ')
+
+        # a hung Z3 query in a mutation must not freeze the suite either
+        mutator = None
+        if self.solver_deadline is not None:
+            mutator = SupervisedMutator(self.grammar, self.formula, self.solver_deadline, solver.timeout_seconds)
+        with closing(mutator) if mutator is not None else nullcontext():
+            mutate = mutator.mutate if mutator is not None else solver.mutate
+            self.mutate_samples(oracle, pool, mutate, guide, scheduler, num_tries, budget)
+        if mutator is not None:
+            self.debug(mutator.summary(), end='... ')
+
+        positive_examples, negative_examples = pool.positive, pool.negative
+        self.debug(f'came up with {len(positive_examples)} positive and {len(negative_examples)} negative '
+                   f'({pool.duplicate_rate:.0%} duplicates)')
+        # self.debug(f'p example: {positive_examples[len(positive_examples) // 2]}')
+        # self.debug(f'n example: {negative_examples[len(negative_examples) // 2]}')
+        return positive_examples, negative_examples
 
-            try:
-                sample = solver.solve()
-                if property(sample):
-                    positive_examples.append(sample)
-                else:
-                    negative_examples.append(sample)
-            except StopIteration:
-                break
+    def mutate_samples(
+        self,
+        oracle: ConditionOracle,
+        pool: SamplePool,
+        mutate: Callable[[DerivationTree], DerivationTree | None],
+        guide: CoverageGuide | None = None,
+        scheduler: MutationScheduler | None = None,
+        num_tries: int = 100,
+        budget: Budget | None = None,
+    ):
+        '''Grow the labelled `pool` with mutants of its samples; `mutate` gives None for a
+        sample whose mutation did not finish'''
+        budget = budget or Budget()
+        if guide is not None and len(pool.positive) == 0:
+            self.explore_coverage(guide, mutate, pool, num_tries, budget)
 
         # print(f'so far p {len(positive_examples)} n {len(negative_examples)}')
         # print('mutating')
-        tried = 0
-        while len(positive_examples) < self.target_num_samples and tried < num_tries:
-            if len(positive_examples) == 0:
+        scheduler = scheduler or MutationScheduler(**{'power': PowerSchedule(), **self.mutation_options})
+        seeds = list(pool)
+        for sample, outcome in zip(seeds, oracle.oracle.observe_all(seeds)):
+            scheduler.offer(sample, outcome)
+
+        while len(pool.positive) < self.target_num_samples and not budget.should_stop():
+            if len(pool.positive) == 0:
                 self.debug('no positive examples to mutate', end='... ')
                 break
+            if not scheduler.should_continue():
+                break
 
-            new_positive = []
-            new_negative = []
+            start = perf_counter()
+            attempted = 0
+            mutants = []
+            parents = []
+            for sample in scheduler.next_seeds():
+                if budget.should_stop():
+                    break
+                attempted += 1
+                mutant = mutate(sample)
+                if mutant is None:
+                    continue
+                if pool.add(mutant):
+                    mutants.append(mutant)
+                    parents.append(sample)
+                elif scheduler.power is not None:
+                    scheduler.power.duplicate(sample)
+
+            outcomes = oracle.oracle.observe_all(mutants)
+            labels = [outcome[oracle.index] for outcome in outcomes]
+            for mutant, parent, outcome, label in zip(mutants, parents, outcomes, labels):
+                pool.label(mutant, label)
+                scheduler.offer(mutant, outcome, parent)
+
+            positive = sum(labels)
+            scheduler.record(RoundStats(attempted, positive, len(labels) - positive, attempted - len(mutants), perf_counter() - start))
+
+        if scheduler.rounds:
+            self.debug(scheduler.summary(), end='... ')
+
+    def explore_coverage(
+        self,
+        guide: CoverageGuide,
+        mutate: Callable[[DerivationTree], DerivationTree | None],
+        pool: SamplePool,
+        max_runs: int = 100,
+        budget: Budget | None = None,
+    ):
+        '''Mutate the inputs that reached new code of the test, and the new-coverage inputs found
+        that way, until one of them triggers the condition or `max_runs` more runs were spent'''
+        budget = budget or Budget()
+        last_run = guide.runs + max_runs
+        rounds = 0
+        while len(pool.positive) == 0 and guide.runs < last_run and not budget.should_stop():
+            rounds += 1
+            mutants = []
+            for seed in list(guide.seeds):
+                if budget.should_stop() or guide.runs + len(mutants) >= last_run:
+                    break
+                mutant = mutate(seed)
+                if mutant is not None and pool.add(mutant):
+                    mutants.append(mutant)
+            if len(mutants) == 0:
+                break
 
-            all_examples = chain(iter(positive_examples), iter(negative_examples))
-            for sample in all_examples:
-                mutant = solver.mutate(sample)
-                if property(mutant):
-                    new_positive.append(mutant)
-                else:
-                    new_negative.append(mutant)
+            for mutant, is_positive in zip(mutants, guide.label(mutants)):
+                pool.label(mutant, is_positive)
 
-            positive_examples.extend(new_positive)
-            negative_examples.extend(new_negative)
-
-        self.debug(f'came up with {len(positive_examples)} positive and {len(negative_examples)} negative')
-        # self.debug(f'p example: {positive_examples[len(positive_examples) // 2]}')
-        # self.debug(f'n example: {negative_examples[len(negative_examples) // 2]}')
-        return positive_examples, negative_examples
+        self.debug(f'explored {len(guide.covered)} locations with {len(guide.seeds)} seeds in {rounds} rounds',
+                   end='... ')
 
     #TODO: allow custom preconditions
     #TODO: setup testing custom preconditions
     #TODO: set up the three-way benchmark
 
-    def results_accuracy(self, num_samples_per_experiment = 1000):
+    def results_accuracy(
+        self,
+        num_samples_per_experiment = 1000,
+        batch_size: int = 100,
+        budget_seconds: float | None = None,
+        test_budget_seconds: float | None = None,
+        tolerance: float | None = None,
+        confidence: float = 0.95,
+        min_corpus_matches: int = 30,
+    ):
+        '''Measure every learned precondition against the suite formula alone.
+
+        The raw inputs form one labelled corpus, shared by all tests. A precondition is
+        measured by evaluating it on the corpus, which also gives its recall; only if fewer
+        than `min_corpus_matches` corpus inputs satisfy it are new inputs generated for it.
+
+        With a `tolerance`, sampling is sequential: each experiment stops as soon as the Wilson
+        interval of its accuracy is at most `tolerance` wide, and `num_samples_per_experiment`
+        only caps it.
+        '''
         if len(self.results) == 0:
             raise RuntimeError("No results to evaluate")
-        
-        raw_inputs = list(islice(self.test_inputs(), num_samples_per_experiment))
-        for test, preconditions in self.results:
-            for precondition in preconditions:
-                assert isinstance(precondition, Formula)
-                # measure raw results
-                try:
-                    constraint_inputs = islice(self.test_inputs(precondition), num_samples_per_experiment)
-                    raw_passing, raw_failing = self.split_on_passing(raw_inputs, test)
-                    res_passing, res_failing = self.split_on_passing(constraint_inputs, test)
-                    yield test, precondition, raw_passing, raw_failing, res_passing, res_failing
-                except:
-                    yield test, precondition, None, None, None, None
-
-    def test_inputs(self, precondition: Formula | None = None):
+
+        budget = Budget(budget_seconds)
+        with ExitStack() as stack:
+            # one oracle per test function: raw inputs are run once for all of its conditions
+            groups = self.groups()
+            oracles = [stack.enter_context(self.oracle([self.tests[i] for i in group])) for group in groups]
+            corpus, corpus_outcomes = self.corpus(oracles, num_samples_per_experiment, batch_size, budget,
+                                                  tolerance, confidence)
+            baseline_exhausted = budget.interrupted
+
+            for group, oracle, outcomes in zip(groups, oracles, corpus_outcomes):
+                for position, i in enumerate(group):
+                    labels = [outcome[position] for outcome in outcomes]
+                    raw_passing = sum(labels)
+                    raw_failing = len(labels) - raw_passing
+                    test, preconditions = self.results[i]
+                    validate_condition = oracle.for_condition(test.condition)
+                    test_budget = budget.child(test_budget_seconds)
+
+                    # equivalent preconditions reuse the result of their representative
+                    equivalents = self.equivalents.get(i, {})
+                    measured: dict[Formula, AccuracyResult] = {}
+                    ordered = [p for p in preconditions if p not in equivalents] + [p for p in preconditions if p in equivalents]
+                    for precondition in ordered:
+                        assert isinstance(precondition, Formula)
+                        if precondition in equivalents:
+                            representative = equivalents[precondition]
+                            if representative in measured:
+                                yield replace(measured[representative], precondition=precondition,
+                                              equivalent_to=representative)
+                            else:
+                                yield AccuracyResult(test, precondition, measured=False, confidence=confidence,
+                                                     equivalent_to=representative)
+                            continue
+                        if test_budget.should_stop():
+                            yield AccuracyResult(test, precondition, measured=False, budget_exhausted=True,
+                                             confidence=confidence)
+                            continue
+                        # no yield inside the try: closing the generator early must close the oracles
+                        try:
+                            matches = self.matches(precondition, corpus, test_budget)
+                            matched = [label for label, match in zip(labels, matches) if match]
+                            if test_budget.interrupted:
+                                result = AccuracyResult(test, precondition, measured=False, budget_exhausted=True,
+                                                        confidence=confidence)
+                            elif len(corpus) == 0:
+                                # without raw inputs there is nothing to compare against
+                                result = AccuracyResult(test, precondition, measured=False,
+                                                        budget_exhausted=baseline_exhausted, confidence=confidence)
+                            elif len(matched) >= max(1, min_corpus_matches):
+                                res_passing = sum(matched)
+                                exhausted = baseline_exhausted or i in self.budget_exhausted
+                                result = AccuracyResult(
+                                    test, precondition, raw_passing, raw_failing,
+                                    res_passing, len(matched) - res_passing,
+                                    budget_exhausted=exhausted, confidence=confidence,
+                                    generation_mode='corpus',
+                                    recall=_ratio(res_passing, raw_passing - res_passing),
+                                )
+                            else:
+                                generator = self.test_inputs(precondition, test_budget)
+                                with closing(generator), \
+                                        self.stream(islice(generator, num_samples_per_experiment), generator.close) as constraint_inputs:
+                                    res_passing, res_failing = self.count_passing(constraint_inputs, validate_condition,
+                                                                                  batch_size, test_budget, tolerance, confidence)
+                                # polled again: the budget also caps the solver timeout, which may have ended generation
+                                res_samples = res_passing + res_failing
+                                cut_short = res_samples < num_samples_per_experiment and not (
+                                    tolerance is not None and interval_width(res_passing, res_samples, confidence) <= tolerance)
+                                exhausted = (baseline_exhausted or i in self.budget_exhausted or test_budget.should_stop()
+                                             or (test_budget.capped and cut_short))
+                                result = AccuracyResult(
+                                    test, precondition, raw_passing, raw_failing, res_passing, res_failing,
+                                    # no inputs: unsatisfiable, timed out, or the generator died
+                                    measured=res_samples > 0,
+                                    budget_exhausted=exhausted, confidence=confidence,
+                                    generation_mode=generator.mode,
+                                )
+                        except Exception:
+                            result = AccuracyResult(test, precondition, measured=False,
+                                                    budget_exhausted=test_budget.should_stop(), confidence=confidence)
+
+                        if result.measured:
+                            measured[precondition] = result
+                        yield result
+
+    def label_matrix(
+        self,
+        num_samples: int = 1000,
+        batch_size: int = 100,
+        budget_seconds: float | None = None,
+    ) -> tuple[LabelMatrix, list[tuple[ObservableTest, Formula]]]:
+        '''Label one corpus for every test and learned precondition (requires numpy). Returns
+        the matrix and the (test, precondition) pair of each of its precondition columns.'''
+        if len(self.results) == 0:
+            raise RuntimeError("No results to evaluate")
+
+        with ExitStack() as stack:
+            groups = self.groups()
+            oracles = [stack.enter_context(self.oracle([self.tests[i] for i in group])) for group in groups]
+            corpus, corpus_outcomes = self.corpus(oracles, num_samples, batch_size, Budget(budget_seconds))
+
+        conditions = [[False] * len(self.tests) for _ in corpus]
+        for group, outcomes in zip(groups, corpus_outcomes):
+            for row, outcome in zip(conditions, outcomes):
+                for i, label in zip(group, outcome):
+                    row[i] = label
+
+        pairs = [(i, precondition) for i, (_, preconditions) in enumerate(self.results) for precondition in preconditions]
+        membership = [self.matches(precondition, corpus) for _, precondition in pairs]
+        matrix = LabelMatrix(conditions, list(zip(*membership)) if membership else [[]] * len(corpus), [i for i, _ in pairs],
+                             num_tests=len(self.tests))
+        return matrix, [(self.tests[i], precondition) for i, precondition in pairs]
+
+    def corpus(
+        self,
+        oracles: list[Oracle],
+        num_samples: int,
+        batch_size: int = 100,
+        budget: Budget | None = None,
+        tolerance: float | None = None,
+        confidence: float = 0.95,
+    ) -> tuple[list[DerivationTree], list[list[Outcome]]]:
+        '''Test inputs only constrained by the suite formula, along with their outcomes for every
+        oracle. With a `tolerance`, the stream stops once every condition's interval is narrow enough.'''
+        budget = budget or Budget()
+        samples = []
+        outcomes = [[] for _ in oracles]
+        generator = self.test_inputs(budget=budget)
+        with closing(generator), self.stream(islice(generator, num_samples), generator.close) as generated:
+            for batch in batched(takewhile(lambda _: not budget.should_stop(), generated), batch_size):
+                samples.extend(batch)
+                for oracle, oracle_outcomes in zip(oracles, outcomes):
+                    oracle_outcomes.extend(oracle.observe_all(batch))
+
+                if tolerance is not None and all(
+                    interval_width(passing, passing + failing, confidence) <= tolerance
+                    for oracle, oracle_outcomes in zip(oracles, outcomes)
+                    for passing, failing in _counts(oracle_outcomes, len(oracle.conditions))
+                ):
+                    break
+
+        return samples, outcomes
+
+    def matches(self, formula: Formula, samples: Iterable[DerivationTree], budget: Budget | None = None) -> list[bool]:
+        '''Whether each sample satisfies `formula`, by evaluating it on the sample'''
+        budget = budget or Budget()
+        return [
+            evaluate(formula, sample, self.grammar, graph=self.sampler.graph).is_true()
+            for sample in takewhile(lambda _: not budget.should_stop(), samples)
+        ]
+
+    def count_passing(
+        self,
+        samples: Iterable,
+        oracle: ConditionOracle,
+        batch_size: int = 100,
+        budget: Budget | None = None,
+        tolerance: float | None = None,
+        confidence: float = 0.95,
+    ) -> tuple[int, int]:
+        budget = budget or Budget()
+        passing = failing = 0
+        for batch in batched(takewhile(lambda _: not budget.should_stop(), samples), batch_size):
+            labels = oracle.label(batch)
+            passing += sum(labels)
+            failing += len(labels) - sum(labels)
+            if tolerance is not None and interval_width(passing, passing + failing, confidence) <= tolerance:
+                break
+        return passing, failing
+
+    def test_inputs(self, precondition: Formula | None = None, budget: Budget | None = None) -> HybridGenerator:
+        budget = budget or Budget()
         test_constraints = self.formula
         if test_constraints is None:
             test_constraints = precondition
         elif precondition is not None:
             test_constraints = test_constraints & precondition
 
-        solver = None
-        if test_constraints is not None:
-            solver = ISLaSolver(self.grammar, test_constraints)
-        else:
-            solver = ISLaSolver(self.grammar)
-
-        return generate_until_absolutely_cannot_anymore(solver)
+        return HybridGenerator(self.sampler, test_constraints, self.solvers, self.rejection_threshold,
+                               timeouts=budget.timeout(10), shards=self.generation_shards,
+                               deadline=self.solver_deadline, budget=budget)
     
-    def split_on_passing(self, samples: Iterable, test: ObservableTest):
-        def passes(input: DerivationTree) -> bool:
-            test.condition.reset()
-            test.test_func(self.convert_input(input))
-            return test.condition.was_triggered
-        
+    def split_on_passing(self, samples: Iterable, oracle: ConditionOracle):
+        samples = list(samples)
+
         passing, failing = [], []
-        for sample in samples:
-            if passes(sample):
+        for sample, label in zip(samples, oracle.label(samples)):
+            if label:
                 passing.append(sample)
             else:
                 failing.append(sample)
     
         return passing, failing
 
+_worker_suite: ObservableTestSuite | None = None
+
+def _init_worker(suite: ObservableTestSuite):
+    global _worker_suite
+    _worker_suite = suite
+
+def _learn_in_worker(
+    group: list[int],
+    print_progress: bool,
+    max_learner_retries: int,
+    budget: Budget,
+    test_budget_seconds: float | None,
+) -> list[tuple[list[Formula], bool, dict[Formula, Formula]]]:
+    tests = [_worker_suite.tests[i] for i in group]
+    return _worker_suite.learn_group(tests, print_progress, max_learner_retries, budget, test_budget_seconds)
+
 def learner_results_to_formula(results: dict[Formula, tuple[float, float]]) -> Formula:
     return ...
             
@@ -3,24 +3,48 @@ from isla.derivation_tree import DerivationTree
 from isla.fuzzer import GrammarCoverageFuzzer
 from isla.solver import ISLaSolver
 
-from isla.language import parse_bnf, parse_isla, Formula
+from isla.language import parse_bnf, parse_isla, Formula, ISLaUnparser
+from isla.isla_predicates import STANDARD_SEMANTIC_PREDICATES, STANDARD_STRUCTURAL_PREDICATES
 
-from multiprocessing import Process, Queue
-from typing import Generator, Any
-from itertools import islice
+from dataclasses import dataclass, field
+from collections import deque
+from typing import Generator, Any, Callable, Iterable, Iterator, Self
+from itertools import chain, islice
+from time import perf_counter
+
+import multiprocessing
+import queue
+import random
+import threading
+import z3
+
+from .pool import SamplePool
+from .solvers import SolverFactory, default_factory
 
 def input_generator(grammar: Grammar):
     fuzzer = GrammarCoverageFuzzer(grammar)
     yield fuzzer.expand_tree(DerivationTree("<start>", None))
 
-def generate_until_absolutely_cannot_anymore(solver: ISLaSolver, timeouts: int = 10):
+def generate_until_absolutely_cannot_anymore(
+    solver: ISLaSolver,
+    timeouts: int = 10,
+    pool: SamplePool | None = None,
+    seeds: Iterable[DerivationTree] = (),
+):
+    '''Yield distinct solutions, then mutants of them until a round of mutation yields nothing new.
+    Pass a `pool` to deduplicate against earlier samples, or to inspect the duplicate rate.
+    With `seeds`, solving is skipped and mutation starts from the seeds.'''
     # print("generate", solver.grammar, solver.formula)
+    if pool is None:
+        pool = SamplePool()
     solver.timeout_seconds = timeouts
-    generated = []
-    keep_going = True
+    generated = list(seeds)
+    keep_going = len(generated) == 0
     while keep_going:
         try:
             solution = solver.solve()
+            if not pool.add(solution):
+                continue
             generated.append(solution)
             # print('solution', solution)
             yield solution
@@ -36,19 +60,518 @@ def generate_until_absolutely_cannot_anymore(solver: ISLaSolver, timeouts: int =
             # print('mutating', sample, end=' - ')
             mutant = solver.mutate(sample)
             # print('got', mutant)
+            if not pool.add(mutant):
+                continue
             mutants.append(mutant)
             yield mutant
         generated = mutants
 
-def generate_with_retries(solver: ISLaSolver, timeout_sec: int = 20) -> Generator[DerivationTree, Any, None]:
+def generate_with_retries(
+    solver: ISLaSolver,
+    timeout_sec: int = 20,
+    pool: SamplePool | None = None,
+    solvers: SolverFactory = default_factory,
+) -> Generator[DerivationTree, Any, None]:
+    if pool is None:
+        pool = SamplePool()  # shared by the retries, so a fresh solver does not repeat old samples
     keep_going = True
     while keep_going:
-        generator = generate_until_absolutely_cannot_anymore(solver)
+        generator = generate_until_absolutely_cannot_anymore(solver, pool=pool)
         for solution in islice(generator, 30):
             yield solution
         
         # print('\n\n\nnew generator\n\n\n')
-        solver = ISLaSolver(solver.grammar, solver.formula)
+        solver = solvers.renew(solver)
+
+def solutions(solver: ISLaSolver) -> Generator[DerivationTree, Any, None]:
+    '''Yield the solver's solutions until it runs out of them or time'''
+    while True:
+        try:
+            yield solver.solve()
+        except (StopIteration, TimeoutError):
+            return
+
+class Prefetcher:
+    '''Iterates `iterable` in a background thread, keeping up to `size` items ready, so that
+    producing the next input overlaps with consuming the last one. The producer blocks while
+    the buffer is full. Exceptions are re-raised in the consumer. Closing (or leaving the
+    `with` block) stops the producer and waits for its current item; `on_close` is called
+    before waiting, e.g. to stop processes whose output the producer may be waiting for.'''
+
+    _done = object()
+
+    def __init__(self, iterable: Iterable, size: int = 16, on_close: Callable[[], Any] | None = None) -> None:
+        self.buffer = queue.Queue(maxsize=size)
+        self.on_close = on_close
+        self.stopped = threading.Event()
+        self.finished = False
+        self.produced = 0
+        self.waits = 0
+        self.thread = threading.Thread(target=self._produce, args=(iterable,), daemon=True)
+        self.thread.start()
+
+    def _produce(self, iterable: Iterable):
+        try:
+            for item in iterable:
+                if not self._put(item):
+                    return
+                self.produced += 1
+            self._put(self._done)
+        except BaseException as e:
+            self._put(_Failure(e))
+
+    def _put(self, item) -> bool:
+        while not self.stopped.is_set():
+            try:
+                self.buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __iter__(self) -> Iterator:
+        return self
+
+    def __next__(self):
+        if self.finished:
+            raise StopIteration
+        if self.buffer.empty():
+            self.waits += 1  # the consumer outpaced the producer
+        item = self.buffer.get()
+        if item is self._done:
+            self.finished = True
+            raise StopIteration
+        if isinstance(item, _Failure):
+            self.finished = True
+            raise item.exception
+        return item
+
+    def close(self, timeout: float | None = None):
+        self.finished = True
+        self.stopped.set()
+        if self.on_close is not None:
+            self.on_close()
+        self.thread.join(timeout)
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+class _Failure:
+    def __init__(self, exception: BaseException) -> None:
+        self.exception = exception
+
+@dataclass
+class ShardStats:
+    produced: int = 0
+    duplicates: int = 0
+    started: float = field(default_factory=perf_counter)
+
+    @property
+    def throughput(self) -> float:
+        '''Samples per second, duplicates included'''
+        elapsed = perf_counter() - self.started
+        return self.produced / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def duplicate_rate(self) -> float:
+        return self.duplicates / self.produced if self.produced else 0.0
+
+class ShardedGenerator:
+    '''Distinct inputs from `shards` solver processes for the same grammar and formula, each
+    seeded differently and running `generate_until_absolutely_cannot_anymore`. Their samples
+    are merged into one iterator, deduplicated through `pool`; `stats` has the throughput and
+    duplicate rate of every shard. Processes are started on first iteration and stopped once
+    the iterator is exhausted or closed.'''
+
+    def __init__(
+        self,
+        grammar: Grammar,
+        formula: Formula | None = None,
+        shards: int = 4,
+        timeouts: int | None = 10,
+        seed: int | None = None,
+        buffer: int = 64,
+        pool: SamplePool | None = None,
+    ) -> None:
+        self.grammar = grammar
+        self.formula = formula
+        self.shards = shards
+        self.timeouts = timeouts
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        self.buffer = buffer
+        self.pool = pool if pool is not None else SamplePool()
+        self.stats = [ShardStats() for _ in range(shards)]
+        self.processes = []
+
+        # forking a process that runs other threads (e.g. a Prefetcher) is unsafe
+        self.context = multiprocessing.get_context('spawn')
+        self.output = None
+        self.stop = None
+
+    def start(self):
+        formula = ISLaUnparser(self.formula).unparse() if self.formula is not None else None
+        self.output = self.context.Queue(self.buffer)
+        self.stop = self.context.Event()
+        self.processes = [
+            self.context.Process(
+                target=_generate_shard,
+                args=(index, self.grammar, formula, self.seed + index, self.timeouts, self.output, self.stop),
+                daemon=True,
+            )
+            for index in range(self.shards)
+        ]
+        for process in self.processes:
+            process.start()
+        self.stats = [ShardStats() for _ in range(self.shards)]
+
+    def __iter__(self) -> Iterator[DerivationTree]:
+        if not self.processes:
+            self.start()
+        active = self.shards
+        try:
+            while active > 0:
+                try:
+                    index, parse_tree = self.output.get(timeout=0.1)
+                except queue.Empty:
+                    # closed from another thread, or every shard died without a word
+                    stop = self.stop
+                    if stop is None or stop.is_set() or not any(p.is_alive() for p in self.processes):
+                        return
+                    continue
+                if parse_tree is None:
+                    active -= 1
+                    continue
+                self.stats[index].produced += 1
+                sample = DerivationTree.from_parse_tree(parse_tree)
+                if self.pool.add(sample):
+                    yield sample
+                else:
+                    self.stats[index].duplicates += 1
+        finally:
+            self.close()
+
+    def close(self):
+        if self.stop is None:
+            return
+        self.stop.set()
+        for process in self.processes:
+            process.join(1)
+            if process.is_alive():
+                process.terminate()
+        self.output.cancel_join_thread()
+        self.stop = None
+
+    def summary(self) -> str:
+        return ', '.join(
+            f'shard {index}: {stats.produced} at {stats.throughput:.1f}/s ({stats.duplicate_rate:.0%} duplicates)'
+            for index, stats in enumerate(self.stats)
+        )
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+class SupervisedGenerator:
+    '''Distinct inputs from a solver running in a supervised child process.
+
+    A Z3 query can hold a solver far beyond its timeout. When the child yields nothing for
+    `deadline` seconds (plus up to `startup_seconds` while it builds its solver), it is killed
+    and restarted with a new random seed, mutating the last good samples instead of solving
+    again; `stalls` counts these restarts. With `retries`, the child generates as
+    `generate_with_retries` does, renewing its solver every 30 samples, and a child that runs
+    out of inputs anyway is replaced by a fresh one. `start()` launches the child ahead of
+    iteration and waits until its solver is built.
+    '''
+
+    def __init__(
+        self,
+        grammar: Grammar,
+        formula: Formula | None = None,
+        deadline: float = 30,
+        timeouts: int | None = 10,
+        seed: int | None = None,
+        retries: bool = False,
+        max_stalls: int = 10,
+        reseed_size: int = 20,
+        startup_seconds: float = 30,
+        buffer: int = 64,
+        pool: SamplePool | None = None,
+    ) -> None:
+        self.grammar = grammar
+        self.formula = formula
+        self.deadline = deadline
+        self.timeouts = timeouts
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        self.retries = retries
+        self.max_stalls = max_stalls
+        self.reseed_size = reseed_size
+        self.startup_seconds = startup_seconds
+        self.buffer = buffer
+        self.pool = pool if pool is not None else SamplePool()
+
+        self.context = multiprocessing.get_context('spawn')
+        self.process = None
+        self.output = None
+        self.closed = False
+        self._ready = False
+        self.starts = 0
+        self.stalls = 0
+
+    def _start(self, seeds: list[DerivationTree]):
+        formula = ISLaUnparser(self.formula).unparse() if self.formula is not None else None
+        self.output = self.context.Queue(self.buffer)
+        self.process = self.context.Process(
+            target=_generate_supervised,
+            args=(self.grammar, formula, self.seed + self.starts, self.timeouts,
+                  [seed.to_parse_tree() for seed in seeds], self.retries, self.output),
+            daemon=True,
+        )
+        self.process.start()
+        self.starts += 1
+
+    def _kill(self):
+        process, self.process = self.process, None
+        if process is not None:
+            process.kill()
+            process.join()
+            self.output.cancel_join_thread()
+
+    def _get(self, timeout: float):
+        '''The child's next output; raises queue.Empty after `timeout`, or early if the child died.
+        None once the child is done, or once the generator was closed from another thread.'''
+        output, process = self.output, self.process
+        end = perf_counter() + timeout
+        while True:
+            try:
+                return output.get(timeout=min(1.0, max(0.0, end - perf_counter())))
+            except queue.Empty:
+                if self.closed:
+                    return None
+                if perf_counter() >= end or not process.is_alive():
+                    raise
+
+    def start(self):
+        '''Launch the child and wait until it is ready to generate'''
+        self._start([])
+        try:
+            ready = self._get(self.startup_seconds)
+        except queue.Empty:
+            ready = None
+        if ready is not True:
+            self._kill()
+            raise RuntimeError('The solver process did not start')
+        self._ready = True
+
+    def __iter__(self) -> Iterator[DerivationTree]:
+        recent: deque[DerivationTree] = deque(maxlen=self.reseed_size)
+        if self.process is None:
+            self._start([])
+        timeout = self.deadline if self._ready else self.deadline + self.startup_seconds
+        try:
+            while True:
+                try:
+                    parse_tree = self._get(timeout)
+                except queue.Empty:
+                    self.stalls += 1
+                    self._kill()
+                    if self.stalls > self.max_stalls or self.closed:
+                        return
+                    self._start(list(recent))
+                    timeout = self.deadline + self.startup_seconds
+                    continue
+
+                if parse_tree is True:  # the child built its solver
+                    timeout = self.deadline
+                    continue
+
+                if parse_tree is None:
+                    self._kill()
+                    if not self.retries or self.closed:
+                        return
+                    self._start([])
+                    timeout = self.deadline + self.startup_seconds
+                    continue
+
+                timeout = self.deadline
+                sample = DerivationTree.from_parse_tree(parse_tree)
+                recent.append(sample)
+                if self.pool.add(sample):
+                    yield sample
+        finally:
+            self._kill()
+
+    def close(self):
+        self.closed = True
+        self._kill()
+
+    def summary(self) -> str:
+        return f'{len(self.pool)} samples from {self.starts} solver processes, {self.stalls} stalled'
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+class SupervisedMutator:
+    '''Mutates samples with a solver in a supervised child process, which stays up between calls.
+
+    A mutation that takes longer than `deadline` seconds (plus `startup_seconds` while a new
+    child builds its solver) kills the child; that sample gets no mutant, `stalls` counts it,
+    and the next mutation starts a new child with a new random seed. After more than
+    `max_stalls` stalls, no child is started anymore and no sample gets a mutant.
+    '''
+
+    def __init__(
+        self,
+        grammar: Grammar,
+        formula: Formula | None = None,
+        deadline: float = 30,
+        timeouts: int | None = 10,
+        seed: int | None = None,
+        max_stalls: int = 10,
+        startup_seconds: float = 30,
+    ) -> None:
+        self.grammar = grammar
+        self.formula = formula
+        self.deadline = deadline
+        self.timeouts = timeouts
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        self.max_stalls = max_stalls
+        self.startup_seconds = startup_seconds
+
+        self.context = multiprocessing.get_context('spawn')
+        self.process = None
+        self.connection = None
+        self.starts = 0
+        self.stalls = 0
+
+    def _start(self):
+        formula = ISLaUnparser(self.formula).unparse() if self.formula is not None else None
+        self.connection, child = self.context.Pipe()
+        self.process = self.context.Process(
+            target=_mutate_supervised,
+            args=(self.grammar, formula, self.seed + self.starts, self.timeouts, child),
+            daemon=True,
+        )
+        self.process.start()
+        child.close()
+        self.starts += 1
+
+    def mutate(self, sample: DerivationTree) -> DerivationTree | None:
+        '''A mutant of `sample`, or None if the child hung or died on it. Errors the solver
+        raises are raised here, as they would be in-process'''
+        if self.stalls > self.max_stalls:
+            return None
+        timeout = self.deadline
+        if self.process is None:
+            self._start()
+            timeout += self.startup_seconds
+        self.connection.send(sample.to_parse_tree())
+        if self.connection.poll(timeout):
+            try:
+                reply = self.connection.recv()
+            except EOFError:
+                reply = None
+            if isinstance(reply, BaseException):
+                raise reply
+            if reply is not None:
+                return DerivationTree.from_parse_tree(reply)
+        self.stalls += 1
+        self.close()
+        return None
+
+    def close(self):
+        process, self.process = self.process, None
+        if process is not None:
+            process.kill()
+            process.join()
+            self.connection.close()
+
+    def summary(self) -> str:
+        return f'{self.starts} mutation processes, {self.stalls} stalled'
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+def _parse_formula(formula: str | None, grammar: Grammar) -> Formula | None:
+    '''The formula a child process was sent unparsed, with the predicates ISLa ships'''
+    if formula is None:
+        return None
+    return parse_isla(formula, grammar, STANDARD_STRUCTURAL_PREDICATES, STANDARD_SEMANTIC_PREDICATES)
+
+def _generate_supervised(grammar, formula, seed, timeouts, seeds, retries, output):
+    random.seed(seed)
+    z3.set_param('smt.random_seed', seed % 2 ** 31)
+
+    solver = ISLaSolver(grammar, _parse_formula(formula, grammar))
+    output.put(True)
+
+    pool = SamplePool()
+    seeds = [DerivationTree.from_parse_tree(seed) for seed in seeds]
+    if retries:
+        samples = chain(
+            generate_until_absolutely_cannot_anymore(solver, timeouts=timeouts, pool=pool, seeds=seeds) if seeds else (),
+            generate_with_retries(solver, pool=pool),
+        )
+    else:
+        samples = generate_until_absolutely_cannot_anymore(solver, timeouts=timeouts, pool=pool, seeds=seeds)
+    for sample in samples:
+        output.put(sample.to_parse_tree())
+    output.put(None)
+
+def _mutate_supervised(grammar, formula, seed, timeouts, connection):
+    random.seed(seed)
+    z3.set_param('smt.random_seed', seed % 2 ** 31)
+
+    solver = ISLaSolver(grammar, _parse_formula(formula, grammar))
+    solver.timeout_seconds = timeouts
+    while True:
+        try:
+            parse_tree = connection.recv()
+        except EOFError:
+            return
+        try:
+            reply = solver.mutate(DerivationTree.from_parse_tree(parse_tree)).to_parse_tree()
+        except Exception as e:
+            reply = e
+        try:
+            connection.send(reply)
+        except Exception as e:  # an exception that does not pickle
+            connection.send(RuntimeError(repr(e)))
+
+def _generate_shard(index, grammar, formula, seed, timeouts, output, stop):
+    random.seed(seed)
+    z3.set_param('smt.random_seed', seed % 2 ** 31)
+
+    try:
+        solver = ISLaSolver(grammar, _parse_formula(formula, grammar))
+        # solutions go as parse trees: pickling a DerivationTree drops its caches
+        for sample in generate_until_absolutely_cannot_anymore(solver, timeouts=timeouts):
+            while not stop.is_set():
+                try:
+                    output.put((index, sample.to_parse_tree()), timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if stop.is_set():
+                return
+    finally:
+        if not stop.is_set():
+            output.put((index, None))
+
+def batched(iterable: Iterable, size: int) -> Generator[list, Any, None]:
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
 
 def read_bnf(filename):
     with open(filename, 'r') as f: